@@ -0,0 +1,119 @@
+"""
+Benchmark of request pacing against a local mock server that throttles with 429s.
+
+The server accepts ``--server-rate`` requests per second and answers any
+excess with 429 and a Retry-After header, optionally failing a share of
+requests with 503. Fixed and adaptive limiters are run against it in turn.
+
+Usage:
+    python benchmarks/bench_adaptive_rate.py [--server-rate R] [--start-rate R] [--threads N] [--seconds S]
+"""
+
+import sys
+import time
+import random
+import argparse
+import threading
+from pathlib import Path
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from rate_limiter import AdaptiveRateLimiter, RateLimiter, TokenBucket, request_with_retry  # noqa: E402
+
+
+def make_handler(bucket, error_rate, latency):
+    """Build a request handler that enforces the server-side rate"""
+
+    class ThrottlingHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            with bucket.lock:
+                bucket._refill()
+                allowed = bucket.tokens >= 1
+                if allowed:
+                    bucket.tokens -= 1
+
+            if not allowed:
+                self.send_response(429)
+                self.send_header("Retry-After", "1")
+            elif random.random() < error_rate:
+                self.send_response(503)
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+
+        def log_message(self, *args):
+            pass
+
+    return ThrottlingHandler
+
+
+def run_clients(url, limiter, threads, seconds):
+    """Hammer the server from several threads, returning the status counts"""
+    statuses = Counter()
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+    session = requests.Session()
+
+    def client():
+        while time.monotonic() < deadline:
+            response = request_with_retry(session.get, url, limiter=limiter, max_retries=0, timeout=10)
+            with lock:
+                statuses[response.status_code] += 1
+
+    workers = [threading.Thread(target=client) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return statuses
+
+
+def report(name, statuses, seconds, limiter):
+    total = sum(statuses.values())
+    print(f"{name}:")
+    print(f"  ok/s {statuses[200] / seconds:7.1f}   429s {statuses[429]:5d}   503s {statuses[503]:5d}   "
+          f"requests {total:5d}")
+    if isinstance(limiter, AdaptiveRateLimiter):
+        rates = ", ".join(f"{key} {rate:.1f}/s" for key, rate in limiter.rates().items())
+        print(f"  final rate {rates}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--server-rate', type=float, default=20.0)
+    parser.add_argument('--start-rate', type=float, default=5.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=20.0)
+    args = parser.parse_args()
+
+    bucket = TokenBucket(args.server_rate, capacity=args.server_rate)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(bucket, args.error_rate, args.latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    print(f"Mock server at {url} allows {args.server_rate:.0f} requests/s")
+
+    try:
+        for name, limiter in [
+            ("Fixed rate (start rate)", RateLimiter(args.start_rate)),
+            ("Fixed rate (4x start rate)", RateLimiter(args.start_rate * 4)),
+            ("Adaptive", AdaptiveRateLimiter(args.start_rate, max_rate=args.server_rate * 4)),
+        ]:
+            statuses = run_clients(url, limiter, args.threads, args.seconds)
+            report(name, statuses, args.seconds, limiter)
+            # Let the server's bucket refill between runs
+            time.sleep(1)
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Benchmark of peak memory while the URL CSV files are cleaned, seeded and exported.
+
+Writes synthetic urls_wayback.csv and urls_cleaned.csv files of each size,
+then runs snapshot deduplication, ledger seeding, claiming and export on
+them in a fresh process per size. The working memory of each run is its
+peak RSS minus the RSS right after the imports. The script exits with
+status 1 if the working memory exceeds ``--target-mb`` at any size, or
+grows by more than ``--growth-mb`` from the smallest size to the largest.
+
+Usage:
+    python benchmarks/bench_csv_memory.py [--rows N [N ...]] [--target-mb MB] [--growth-mb MB]
+"""
+
+import sys
+import csv
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+# Share of snapshot rows that repeat an earlier timestamp
+DUPLICATE_EVERY = 10
+
+
+def write_inputs(directory, rows):
+    """Write a snapshots file with header and a cleaned URLs file without, of ``rows`` rows each"""
+    with open(directory / "urls_wayback.csv", 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['timestamp', 'url', 'status'])
+        for index in range(rows):
+            timestamp = 20130101000000 + (index - 1 if index % DUPLICATE_EVERY == 1 else index)
+            writer.writerow([timestamp, f"https://web.archive.org/web/{timestamp}/https://www.cnn.com/",
+                             'yes' if index % 3 == 0 else ''])
+
+    with open(directory / "urls_cleaned.csv", 'w', newline='') as f:
+        writer = csv.writer(f)
+        for index in range(rows):
+            writer.writerow([20130101000000 + index // 20,
+                             f"https://www.cnn.com/2020/01/01/us/story-{index}/index.html", 'no'])
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_stages(directory):
+    """Run the CSV stages on the files in a directory, returning timings and memory in this process"""
+    from status_ledger import StatusLedger
+    from url_extractor import SNAPSHOT_STAGE
+    from article_fetcher import ARTICLE_STAGE
+    from wayback_scraper import WaybackMachineScraper
+    # Imported lazily by the cleaning stage; load them first so their size does not count as working memory
+    import numpy  # noqa: F401
+    import pandas  # noqa: F401
+
+    result = {"import_mb": peak_rss_mb()}
+    wayback_file = directory / "urls_wayback.csv"
+    cleaned_file = directory / "urls_cleaned.csv"
+    scraper = WaybackMachineScraper.__new__(WaybackMachineScraper)
+
+    def timed(name, function):
+        start = time.perf_counter()
+        function()
+        result[f"{name}_s"] = round(time.perf_counter() - start, 2)
+
+    with StatusLedger(directory / "ledger.sqlite") as ledger:
+        timed("dedupe", lambda: scraper._clean_snapshots_file(wayback_file))
+        timed("seed", lambda: (ledger.add_csv(SNAPSHOT_STAGE, wayback_file, header=True),
+                               ledger.add_csv(ARTICLE_STAGE, cleaned_file, header=False)))
+        timed("claim", lambda: sum(1 for _ in ledger.iter_claims(ARTICLE_STAGE, batch_size=1000)))
+        timed("export", lambda: ledger.export_csv(ARTICLE_STAGE, cleaned_file))
+
+    result["peak_mb"] = peak_rss_mb()
+    result["working_mb"] = result["peak_mb"] - result["import_mb"]
+    return result
+
+
+def measure(rows):
+    """Run the stages on ``rows`` rows in a fresh process"""
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        write_inputs(directory, rows)
+        output = subprocess.run([sys.executable, __file__, "--child", str(directory)],
+                                check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--target-mb', type=float, default=48,
+                        help="Largest allowed peak RSS above the post-import RSS at any size")
+    parser.add_argument('--growth-mb', type=float, default=16,
+                        help="Largest allowed growth of that working memory from the smallest size to the largest")
+    parser.add_argument('--child', type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_stages(args.child)))
+        return
+
+    results = {}
+    print(f"{'rows':>10} {'dedupe s':>9} {'seed s':>7} {'claim s':>8} {'export s':>9} "
+          f"{'import MB':>10} {'peak MB':>8} {'working MB':>11}")
+    for rows in sorted(args.rows):
+        result = results[rows] = measure(rows)
+        print(f"{rows:>10} {result['dedupe_s']:>9.2f} {result['seed_s']:>7.2f} {result['claim_s']:>8.2f} "
+              f"{result['export_s']:>9.2f} {result['import_mb']:>10.1f} {result['peak_mb']:>8.1f} "
+              f"{result['working_mb']:>11.1f}")
+
+    working = [result['working_mb'] for result in results.values()]
+    failures = [f"working memory {max(working):.1f} MB is above the {args.target_mb:g} MB target"] \
+        if max(working) > args.target_mb else []
+    if working[-1] - working[0] > args.growth_mb:
+        failures.append(f"working memory grew by {working[-1] - working[0]:.1f} MB, "
+                        f"more than {args.growth_mb:g} MB")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print(f"OK: working memory within {args.target_mb:g} MB and grew by at most {args.growth_mb:g} MB")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark of connection reuse: module-level requests.get against the pooled HTTP client.
+
+A local keep-alive server counts the TCP connections it accepts, so the
+report shows how many requests each connection served.
+
+Usage:
+    python benchmarks/bench_http_client.py [--requests N] [--threads N] [--latency S]
+"""
+
+import sys
+import time
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from http_client import HTTPClient  # noqa: E402
+
+BODY = b"<html><body>" + b"<a href='/story'>story</a>" * 200 + b"</body></html>"
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    """Keep-alive handler that counts new connections"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency = 0.0
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with CountingHandler.lock:
+            CountingHandler.connections += 1
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(get, url, total, threads):
+    """Issue ``total`` GETs from a thread pool, returning the elapsed seconds"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for response in pool.map(lambda _: get(url, timeout=10), range(total)):
+            assert response.status_code == 200
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    CountingHandler.latency = args.latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CountingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    client = HTTPClient(pool_size=args.threads)
+    try:
+        for name, get in [("requests.get", requests.get), ("HTTPClient", client.get)]:
+            CountingHandler.connections = 0
+            elapsed = run(get, url, args.requests, args.threads)
+            print(f"{name:13s} {args.requests / elapsed:8.0f} req/s   "
+                  f"{CountingHandler.connections:5d} connections for {args.requests} requests")
+    finally:
+        client.close()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
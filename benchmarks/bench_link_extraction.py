@@ -0,0 +1,63 @@
+"""
+Microbenchmark for link extraction over stored snapshot HTML fixtures.
+
+Usage:
+    python benchmarks/bench_link_extraction.py [--fixtures DIR] [--repeat N]
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from link_parser import extract_hrefs, extract_hrefs_soup  # noqa: E402
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures" / "snapshots"
+CHUNK_SIZE = 64 * 1024
+
+
+def chunked(data, size=CHUNK_SIZE):
+    """Split bytes into chunks the way a streamed response delivers them"""
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def time_per_page(func, pages, repeat):
+    """Get the best mean seconds per page over several rounds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for page in pages:
+            func(page)
+        best = min(best, (time.perf_counter() - start) / len(pages))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fixtures', type=Path, default=FIXTURES_DIR)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    pages = [path.read_bytes() for path in sorted(args.fixtures.glob("*.html"))]
+    if not pages:
+        sys.exit(f"No snapshot fixtures found in {args.fixtures}")
+
+    # Both paths must agree before their speed is worth comparing
+    for page in pages:
+        assert extract_hrefs(chunked(page)) == extract_hrefs_soup(page.decode('utf-8', 'replace'))
+
+    soup = time_per_page(lambda page: extract_hrefs_soup(page.decode('utf-8', 'replace')), pages, args.repeat)
+    streaming = time_per_page(lambda page: extract_hrefs(chunked(page)), pages, args.repeat)
+
+    size = sum(len(page) for page in pages) / len(pages)
+    print(f"{len(pages)} fixture page(s), {size / 1024:.0f} KiB on average")
+    print(f"BeautifulSoup html.parser: {soup * 1000:8.2f} ms/page")
+    print(f"lxml streaming:            {streaming * 1000:8.2f} ms/page")
+    print(f"Speedup:                   {soup / streaming:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
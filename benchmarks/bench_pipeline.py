@@ -0,0 +1,345 @@
+"""
+Offline end-to-end benchmark of the scraping stages against a local Wayback stand-in.
+
+Runs WaybackMachineScraper, URLExtractor and ArticleFetcher in turn against
+ReplayServer, in a temporary data directory, and reports per stage the
+items per second, p50 and p99 request latency, peak RSS (including parse
+pool processes) and CPU seconds. Results are compared to a stored baseline,
+and the script exits non-zero when a stage regressed by more than the
+tolerance, so it can gate changes in CI.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--snapshots N] [--articles N] [--latency S] [--error-rate R]
+    python benchmarks/bench_pipeline.py --update-baseline
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from config import ScraperConfig, setup  # noqa: E402
+from http_client import HTTPClient  # noqa: E402
+from wayback_scraper import WaybackMachineScraper  # noqa: E402
+from url_extractor import URLExtractor, SNAPSHOT_STAGE  # noqa: E402
+from article_fetcher import ArticleFetcher, ARTICLE_STAGE  # noqa: E402
+from status_ledger import StatusLedger, LEDGER_FILE  # noqa: E402
+from replay_server import ReplayServer, ReplayClient  # noqa: E402
+
+BASELINE_FILE = Path(__file__).resolve().parent / "baselines" / "pipeline.json"
+SITE = "cnn"
+START_YEAR = 2020
+
+# Request routes whose latency is reported for each stage
+STAGE_ROUTES = {
+    "get_snapshots": ("cdx", "available"),
+    "extract_urls": ("snapshot",),
+    "fetch_articles": ("article",),
+}
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+class BenchConfig(ScraperConfig):
+    """Scraper configuration keeping all data in a scratch directory and all requests on the replay server"""
+
+    def __init__(self, data_dir, client, request_rate):
+        self.client = client
+        config_file = data_dir / "sites.json"
+        config_file.write_text(json.dumps({
+            SITE: {"url": {"0": {"link": "https://cnn.com/us", "start_year": START_YEAR, "end_year": START_YEAR}},
+                   "base_url": "cnn.com/"},
+        }))
+        super().__init__(config_file, seen_capacity=1_000_000, request_rate=request_rate,
+                         max_request_rate=request_rate * 4, data_dir=data_dir, logs_dir=data_dir / "logs")
+
+    def get_http_client(self, proxied=False, pool_size=None):
+        if pool_size:
+            self.client.ensure_pool_size(pool_size)
+        return self.client
+
+
+class ResourceSampler:
+    """Tracks the peak resident set size and the CPU time of this process and all its descendants
+
+    Descendants include parse pool processes forked from a fork server,
+    which are grandchildren of this process. Their CPU time is sampled while
+    they run, since they are not reaped by this process.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self.start_cpu = {}
+        self.last_cpu = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def __enter__(self):
+        self.start_cpu = dict(self._sample()[1])
+        self.process_cpu = time.process_time()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.process_cpu = time.process_time() - self.process_cpu
+
+    def _run(self):
+        while True:
+            rss, cpu = self._sample()
+            self.peak = max(self.peak, rss)
+            self.last_cpu.update(cpu)
+            if self.stopped.wait(self.interval):
+                return
+
+    @property
+    def cpu_seconds(self):
+        """Get the CPU seconds used by this process and its descendants while sampling"""
+        return self.process_cpu + sum(max(0.0, cpu - self.start_cpu.get(pid, 0.0))
+                                      for pid, cpu in self.last_cpu.items())
+
+    @staticmethod
+    def _rss(pid):
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                return int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            return 0
+
+    @staticmethod
+    def _cpu(pid):
+        """Get the user and system CPU seconds of a process, or 0 if it is gone"""
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rpartition(')')[2].split()
+            return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        except (OSError, IndexError, ValueError):
+            return 0.0
+
+    def _descendants(self, pid="self"):
+        """Yield the pids of the live descendants of a process"""
+        try:
+            tasks = os.listdir(f"/proc/{pid}/task")
+        except OSError:
+            return
+        for task in tasks:
+            try:
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    children = f.read().split()
+            except OSError:
+                continue
+            for child in children:
+                yield child
+                yield from self._descendants(child)
+
+    def _sample(self):
+        """Get the RSS in bytes of this process plus its descendants, and each descendant's CPU seconds"""
+        if not os.path.exists("/proc/self/task"):
+            # No /proc (e.g. macOS): fall back to the lifetime peak of this process and its reaped children
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                    {"children": children.ru_utime + children.ru_stime})
+
+        total = self._rss("self")
+        cpu = {}
+        for pid in self._descendants():
+            total += self._rss(pid)
+            cpu[pid] = self._cpu(pid)
+        return total, cpu
+
+
+def percentile(values, fraction):
+    """Get a nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def measure(name, run, count_items, client):
+    """Run one stage, returning its measurements"""
+    client.latencies.clear()
+    start = time.perf_counter()
+    with ResourceSampler() as sampler:
+        run()
+    elapsed = time.perf_counter() - start
+
+    latencies = [value for route in STAGE_ROUTES[name] for value in client.latencies.get(route, [])]
+    items = count_items()
+    return {
+        "items": items,
+        "seconds": round(elapsed, 3),
+        "items_per_sec": round(items / elapsed, 2) if elapsed else 0.0,
+        "requests": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        "peak_rss_mb": round(sampler.peak / 1024 ** 2, 1),
+        "cpu_seconds": round(sampler.cpu_seconds, 3),
+    }
+
+
+def count_rows(path, header):
+    """Get the number of data rows in a CSV file"""
+    if not path.exists():
+        return 0
+    with open(path, newline='') as f:
+        return sum(1 for _ in csv.reader(f)) - (1 if header else 0)
+
+
+def count_ledger(config, stage, statuses):
+    """Get the number of ledger rows of a stage in the given statuses"""
+    ledger = StatusLedger(config.get_site_data_path(SITE, LEDGER_FILE))
+    try:
+        counts = ledger.counts(stage)
+    finally:
+        ledger.close()
+    return sum(counts.get(status, 0) for status in statuses)
+
+
+def select_articles(config, limit):
+    """Copy the first extracted URLs into the cleaned URL file the fetcher reads"""
+    with open(config.get_site_data_path(SITE, "urls_uncleaned.csv"), newline='') as f:
+        rows = [row for _, row in zip(range(limit), csv.reader(f))]
+    with open(config.get_site_data_path(SITE, "urls_cleaned.csv"), 'w', newline='') as f:
+        writer = csv.writer(f)
+        for index, row in enumerate(rows):
+            writer.writerow([index, row[1], 'no'])
+    return len(rows)
+
+
+def run_pipeline(args, scratch_root):
+    """Run all stages against a fresh replay server and data directory, returning the results per stage"""
+    server = ReplayServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                          throttle_rate=args.throttle_rate, captures_per_year=args.snapshots,
+                          links_per_snapshot=args.links_per_snapshot).start()
+    client = ReplayClient(server.url, HTTPClient(pool_size=max(args.concurrency, args.io_workers)))
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="round_", dir=scratch_root) as scratch:
+            config = BenchConfig(Path(scratch), client, args.request_rate)
+            scraper = WaybackMachineScraper(config, mode=args.mode)
+            extractor = URLExtractor(config, concurrency=args.concurrency)
+            fetcher = ArticleFetcher(config, io_workers=args.io_workers, parse_workers=args.parse_workers)
+
+            results = {}
+            results["get_snapshots"] = measure(
+                "get_snapshots", lambda: scraper.get_snapshots(SITE),
+                lambda: count_rows(config.get_site_data_path(SITE, "urls_wayback.csv"), header=True), client)
+            results["extract_urls"] = measure(
+                "extract_urls", lambda: extractor.extract_urls(SITE),
+                lambda: count_ledger(config, SNAPSHOT_STAGE, ('yes', 'fail')), client)
+
+            selected = select_articles(config, args.articles)
+            results["fetch_articles"] = measure(
+                "fetch_articles", lambda: fetcher.fetch_articles(SITE),
+                lambda: count_ledger(config, ARTICLE_STAGE, ('yes', 'none', 'fail')), client)
+            results["fetch_articles"]["selected"] = selected
+            results["extract_urls"]["links"] = count_rows(
+                config.get_site_data_path(SITE, "urls_uncleaned.csv"), header=False)
+            return results
+    finally:
+        client.close()
+        server.stop()
+
+
+def report(results, baseline):
+    """Print the results next to the baseline"""
+    print(f"{'stage':15s} {'items':>6s} {'items/s':>9s} {'p50 ms':>8s} {'p99 ms':>8s} {'peak MB':>8s} {'CPU s':>7s}")
+    for stage, result in results.items():
+        print(f"{stage:15s} {result['items']:6d} {result['items_per_sec']:9.1f} {result['p50_ms'] or 0:8.1f} "
+              f"{result['p99_ms'] or 0:8.1f} {result['peak_rss_mb']:8.1f} {result['cpu_seconds']:7.2f}")
+        previous = baseline.get(stage) if baseline else None
+        if previous:
+            print(f"{'  baseline':15s} {previous['items']:6d} {previous['items_per_sec']:9.1f} "
+                  f"{previous['p50_ms'] or 0:8.1f} {previous['p99_ms'] or 0:8.1f} {previous['peak_rss_mb']:8.1f} "
+                  f"{previous['cpu_seconds']:7.2f}")
+
+
+def regressions(results, baseline, tolerance):
+    """List the stages that got slower, more variable or bigger than the baseline allows"""
+    found = []
+    for stage, result in results.items():
+        previous = baseline.get(stage)
+        if not previous:
+            continue
+        if result['items_per_sec'] < previous['items_per_sec'] * (1 - tolerance):
+            found.append(f"{stage}: {result['items_per_sec']} items/s, baseline {previous['items_per_sec']}")
+        if result['p99_ms'] and previous['p99_ms'] and result['p99_ms'] > previous['p99_ms'] * (1 + tolerance):
+            found.append(f"{stage}: p99 {result['p99_ms']} ms, baseline {previous['p99_ms']}")
+        if result['peak_rss_mb'] > previous['peak_rss_mb'] * (1 + tolerance):
+            found.append(f"{stage}: peak RSS {result['peak_rss_mb']} MB, baseline {previous['peak_rss_mb']}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--snapshots', type=int, default=50, help="Captures listed per year")
+    parser.add_argument('--links-per-snapshot', type=int, default=20)
+    parser.add_argument('--articles', type=int, default=200, help="Extracted URLs to fetch")
+    parser.add_argument('--mode', choices=['cdx', 'available'], default='cdx')
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--request-rate', type=float, default=500.0,
+                        help="Starting requests/s per host, high so pacing does not dominate")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--io-workers', type=int, default=8)
+    parser.add_argument('--parse-workers', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3, help="Rounds to run, keeping the best per stage")
+    parser.add_argument('--baseline', type=Path, default=BASELINE_FILE)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help="Allowed relative slowdown before a stage counts as regressed")
+    args = parser.parse_args()
+
+    params = {key: value for key, value in vars(args).items()
+              if key not in ('baseline', 'update_baseline', 'tolerance')}
+    # Keep each stage's fastest round, as scheduling noise only ever slows a round down
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench_pipeline_") as scratch_root:
+        # Set up logging before the first config, so nothing is written to the repository's logs/ and data/
+        setup(data_dir=scratch_root, logs_dir=Path(scratch_root) / "logs")
+        # Keep the scrapers' per-item logging out of the measurements; setup configures INFO
+        logging.getLogger().setLevel(logging.ERROR)
+        for _ in range(args.repeat):
+            for stage, result in run_pipeline(args, scratch_root).items():
+                if stage not in results or result['items_per_sec'] > results[stage]['items_per_sec']:
+                    results[stage] = result
+
+    stored = json.loads(args.baseline.read_text()) if args.baseline.exists() else None
+    report(results, stored and stored['results'])
+
+    if args.update_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps({"params": params, "results": results}, indent=2) + "\n")
+        print(f"Wrote baseline to {args.baseline}")
+        return 0
+
+    if stored is None:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one")
+        return 0
+    if stored['params'] != params:
+        print("Warning: parameters differ from the baseline run, so the comparison is only indicative")
+
+    found = regressions(results, stored['results'], args.tolerance)
+    for line in found:
+        print(f"REGRESSION {line}")
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
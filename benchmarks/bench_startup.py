@@ -0,0 +1,157 @@
+"""
+Benchmark of startup cost: import time of each entry point, from python -X importtime.
+
+Imports every entry point in a fresh interpreter, several times, and reports
+the fastest cumulative import time of the module, the wall time of the whole
+process and the direct imports that cost the most. It also checks that none
+of the heavy optional dependencies is imported before it is used. Results are
+compared to a stored baseline, and the script exits non-zero when an entry
+point got slower than the tolerance allows or imports a heavy module eagerly.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat N] [--tolerance T]
+    python benchmarks/bench_startup.py --update-baseline
+"""
+
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+BASELINE_FILE = Path(__file__).resolve().parent / "baselines" / "startup.json"
+
+ENTRY_POINTS = [
+    "config",
+    "main",
+    "orchestrator",
+    "distributed",
+    "wayback_scraper",
+    "url_extractor",
+    "article_fetcher",
+    "preprocess.keyword_index",
+]
+
+# Modules that are slow to import and must only be loaded where they are used
+LAZY_MODULES = ("newsplease", "pandas", "numpy", "pyarrow", "bs4", "dotenv")
+
+# Lazy modules an entry point needs as soon as it is imported
+EAGER_ALLOWED = {
+    "preprocess.keyword_index": {"numpy"},
+}
+
+# Slowdowns below this many milliseconds are never reported, as they are within noise
+MIN_REGRESSION_MS = 15
+
+
+def parse_importtime(stderr, module):
+    """Get the module's cumulative import microseconds and its direct imports from -X importtime output
+
+    Lines are ``import time: self | cumulative | name``, with the name indented
+    two spaces per nesting level, and every import is listed after the
+    imports it triggered.
+    """
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if level == 0 and name == module:
+            return int(cumulative), children
+        if level == 0:
+            children = []
+        elif level == 1:
+            children.append((name, int(cumulative)))
+    raise ValueError(f"{module} not found in the importtime output")
+
+
+def measure(module):
+    """Import a module in a fresh interpreter, returning (import us, process seconds, direct imports, lazy modules)"""
+    script = (f"import {module}, sys, json; "
+              f"print(json.dumps([name for name in {LAZY_MODULES!r} if name in sys.modules]))")
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", script], cwd=SRC_DIR,
+                               capture_output=True, text=True, check=True)
+    elapsed = time.perf_counter() - start
+
+    cumulative, children = parse_importtime(completed.stderr, module)
+    loaded = json.loads(completed.stdout.strip().splitlines()[-1])
+    return cumulative, elapsed, children, loaded
+
+
+def run(repeat):
+    """Measure every entry point, keeping its fastest round"""
+    results = {}
+    for module in ENTRY_POINTS:
+        rounds = [measure(module) for _ in range(repeat)]
+        cumulative, _, children, loaded = min(rounds, key=lambda result: result[0])
+        heaviest = sorted(children, key=lambda child: child[1], reverse=True)[:3]
+        results[module] = {
+            "import_ms": round(cumulative / 1000, 1),
+            "process_ms": round(min(result[1] for result in rounds) * 1000, 1),
+            "heaviest": [f"{name} {us / 1000:.0f}ms" for name, us in heaviest],
+            "eager": sorted(set(loaded) - EAGER_ALLOWED.get(module, set())),
+        }
+    return results
+
+
+def report(results, baseline):
+    """Print the results next to the baseline"""
+    print(f"{'entry point':26s} {'import ms':>10s} {'baseline':>9s} {'process ms':>11s}  heaviest imports")
+    for module, result in results.items():
+        previous = baseline.get(module) if baseline else None
+        print(f"{module:26s} {result['import_ms']:10.1f} "
+              f"{previous['import_ms'] if previous else float('nan'):9.1f} {result['process_ms']:11.1f}  "
+              f"{', '.join(result['heaviest'])}")
+
+
+def problems(results, baseline, tolerance):
+    """List the entry points that import heavy modules eagerly or got slower than the baseline allows"""
+    found = []
+    for module, result in results.items():
+        if result['eager']:
+            found.append(f"{module}: imports {', '.join(result['eager'])} eagerly")
+        previous = baseline.get(module) if baseline else None
+        if previous is None:
+            continue
+        slower = result['import_ms'] - previous['import_ms']
+        if slower > MIN_REGRESSION_MS and result['import_ms'] > previous['import_ms'] * (1 + tolerance):
+            found.append(f"{module}: imports in {result['import_ms']} ms, baseline {previous['import_ms']}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help="Imports per entry point, keeping the fastest")
+    parser.add_argument('--baseline', type=Path, default=BASELINE_FILE)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help="Allowed relative slowdown before an entry point counts as regressed")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    stored = json.loads(args.baseline.read_text()) if args.baseline.exists() else None
+    report(results, stored and stored['results'])
+
+    if args.update_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps({"params": {"repeat": args.repeat}, "results": results}, indent=2) + "\n")
+        print(f"Wrote baseline to {args.baseline}")
+        return 0
+
+    if stored is None:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one")
+    found = problems(results, stored and stored['results'], args.tolerance)
+    for line in found:
+        print(f"REGRESSION {line}")
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
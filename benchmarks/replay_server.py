@@ -0,0 +1,268 @@
+"""
+Local stand-in for the Wayback Machine and the news sites, for offline benchmarks.
+
+Serves CDX and availability queries, snapshot pages built from the stored
+snapshot fixtures, and synthetic article pages, with configurable latency
+and error injection. Scrapers reach it through ReplayClient, which maps the
+URLs they request onto the local server, so no scraper code changes.
+
+Usage:
+    python benchmarks/replay_server.py [--port P] [--latency S] [--error-rate R]
+"""
+
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from pathlib import Path
+from datetime import date, timedelta
+from urllib.parse import urlsplit, parse_qs, quote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures" / "snapshots"
+
+# Hour, minute and second of every synthetic capture
+CAPTURE_TIME = "083012"
+
+WORDS = ("the city council officials said residents police state federal court report new week "
+         "election health school water storm season market company people officials county year "
+         "investigation governor plan budget vote community hospital attorney agency emergency").split()
+
+
+def split_target(path):
+    """Map a local path back to (scheme, host, path-and-query) of the URL it stands for"""
+    scheme, _, rest = path.lstrip('/').partition('/')
+    host, _, remainder = rest.partition('/')
+    return scheme, host, '/' + remainder
+
+
+def route_of(host, path):
+    """Classify a request as 'cdx', 'available', 'snapshot' or 'article'"""
+    if host.endswith("archive.org"):
+        if path.startswith("/cdx/search/cdx"):
+            return "cdx"
+        if path.startswith("/wayback/available"):
+            return "available"
+        if path.startswith("/web/"):
+            return "snapshot"
+    return "article"
+
+
+def capture_days(start, end, per_year):
+    """Get ``per_year`` evenly spaced capture days per year between two dates"""
+    days = []
+    for year in range(start.year, end.year + 1):
+        first = date(year, 1, 1)
+        span = (date(year, 12, 31) - first).days + 1
+        for index in range(min(per_year, span)):
+            day = first + timedelta(days=index * span // min(per_year, span))
+            if start <= day <= end:
+                days.append(day)
+    return days
+
+
+def synthetic_article(url):
+    """Build a deterministic article page for a URL"""
+    rng = random.Random(zlib.crc32(url.encode('utf-8')))
+    title = " ".join(rng.choice(WORDS) for _ in range(8)).capitalize()
+    author = f"{rng.choice(['Alex', 'Sam', 'Jordan', 'Casey'])} {rng.choice(['Lee', 'Garcia', 'Smith', 'Khan'])}"
+    published = date(2015, 1, 1) + timedelta(days=rng.randrange(3000))
+    paragraphs = "".join(
+        "<p>" + " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 90))).capitalize() + ".</p>"
+        for _ in range(rng.randint(5, 12))
+    )
+    return (f"<html><head><title>{title}</title><meta name=\"author\" content=\"{author}\">"
+            f"<meta property=\"article:published_time\" content=\"{published.isoformat()}\">"
+            f"<meta name=\"description\" content=\"{title}.\"></head>"
+            f"<body><article><h1>{title}</h1>{paragraphs}</article></body></html>").encode('utf-8')
+
+
+class ReplayServer:
+    """Threaded HTTP server answering for archive.org and the news sites
+
+    ``captures_per_year`` snapshots are listed per year of a CDX query, and
+    each snapshot page is a stored fixture plus ``links_per_snapshot`` article
+    links unique to its capture day. Every response is delayed by
+    ``latency`` plus up to ``jitter`` seconds, and a share of requests fails
+    with 503 (``error_rate``) or 429 with Retry-After (``throttle_rate``).
+    """
+
+    def __init__(self, fixtures_dir=FIXTURES_DIR, port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 throttle_rate=0.0, captures_per_year=366, links_per_snapshot=20, seed=0):
+        self.pages = [path.read_bytes() for path in sorted(Path(fixtures_dir).glob("*.html"))]
+        if not self.pages:
+            raise FileNotFoundError(f"No snapshot fixtures found in {fixtures_dir}")
+
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.captures_per_year = captures_per_year
+        self.links_per_snapshot = links_per_snapshot
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.requests = {}
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="replay-server", daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _roll(self):
+        with self.random_lock:
+            return self.random.random(), self.random.random()
+
+    def _handler(self):
+        replay = self
+
+        class ReplayHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                scheme, host, target = split_target(self.path)
+                route = route_of(host, target)
+                replay.requests[route] = replay.requests.get(route, 0) + 1
+
+                fault, delay = replay._roll()
+                time.sleep(replay.latency + replay.jitter * delay)
+
+                if fault < replay.throttle_rate:
+                    self._send(429, b"", headers={"Retry-After": "1"})
+                elif fault < replay.throttle_rate + replay.error_rate:
+                    self._send(503, b"")
+                else:
+                    status, body, content_type = getattr(replay, f"_{route}")(scheme, host, target)
+                    self._send(status, body, content_type)
+
+            def _send(self, status, body, content_type="text/html", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return ReplayHandler
+
+    def _cdx(self, scheme, host, target):
+        params = {key: values[0] for key, values in parse_qs(urlsplit(target).query).items()}
+        start = date(int(params['from'][:4]), int(params['from'][4:6] or 1), int(params['from'][6:8] or 1))
+        end = date(int(params['to'][:4]), int(params['to'][4:6] or 12), int(params['to'][6:8] or 31))
+        days = capture_days(start, end, self.captures_per_year)
+
+        offset = int(params.get('resumeKey', 0))
+        limit = int(params.get('limit', len(days)))
+        page = days[offset:offset + limit]
+        original = params['url'] if '://' in params['url'] else f"https://{params['url']}"
+
+        rows = [["timestamp", "original"]]
+        rows += [[f"{day:%Y%m%d}{CAPTURE_TIME}", original] for day in page]
+        if offset + limit < len(days):
+            rows += [[], [str(offset + limit)]]
+        return 200, json.dumps(rows).encode('utf-8'), "application/json"
+
+    def _available(self, scheme, host, target):
+        params = {key: values[0] for key, values in parse_qs(urlsplit(target).query).items()}
+        timestamp = f"{params['timestamp'][:8]}{CAPTURE_TIME}"
+        snapshot_url = f"http://web.archive.org/web/{timestamp}/{params['url']}"
+        body = {"url": params['url'], "archived_snapshots": {
+            "closest": {"status": "200", "available": True, "url": snapshot_url, "timestamp": timestamp}}}
+        return 200, json.dumps(body).encode('utf-8'), "application/json"
+
+    def _snapshot(self, scheme, host, target):
+        timestamp = target.split('/')[2]
+        day = timestamp[:8]
+        page = self.pages[zlib.crc32(timestamp.encode()) % len(self.pages)]
+        links = "".join(
+            f"<a href=\"/web/{timestamp}/https://www.cnn.com/{day[:4]}/{day[4:6]}/{day[6:8]}/us/"
+            f"story-{day}-{index}/index.html\">Story {index}</a>"
+            for index in range(self.links_per_snapshot)
+        ).encode('utf-8')
+        marker = page.rfind(b"</body>")
+        marker = marker if marker >= 0 else len(page)
+        return 200, page[:marker] + links + page[marker:], "text/html"
+
+    def _article(self, scheme, host, target):
+        return 200, synthetic_article(f"{scheme}://{host}{target}"), "text/html"
+
+
+class ReplayClient:
+    """Stand-in HTTP client that sends every request to a ReplayServer
+
+    Wraps a real client, typically HTTPClient, and rewrites
+    ``scheme://host/path`` to ``<server>/scheme/host/path``. It records the
+    latency of every request per route.
+    """
+
+    def __init__(self, server_url, client):
+        self.server_url = server_url
+        self.client = client
+        self.latencies = {}
+        self.lock = threading.Lock()
+
+    def proxy_for(self, url):
+        return None
+
+    def ensure_pool_size(self, pool_size):
+        self.client.ensure_pool_size(pool_size)
+
+    def get(self, url, params=None, **kwargs):
+        parts = urlsplit(url)
+        local = f"{self.server_url}/{parts.scheme}/{parts.netloc}{quote(parts.path, safe='/:%')}"
+        if parts.query:
+            local += f"?{parts.query}"
+
+        start = time.perf_counter()
+        response = self.client.get(local, params=params, **kwargs)
+        elapsed = time.perf_counter() - start
+
+        route = route_of(parts.netloc, parts.path)
+        with self.lock:
+            self.latencies.setdefault(route, []).append(elapsed)
+        return response
+
+    def close(self):
+        self.client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--captures-per-year', type=int, default=366)
+    parser.add_argument('--links-per-snapshot', type=int, default=20)
+    args = parser.parse_args()
+
+    server = ReplayServer(port=args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                          throttle_rate=args.throttle_rate, captures_per_year=args.captures_per_year,
+                          links_per_snapshot=args.links_per_snapshot).start()
+    print(f"Replaying on {server.url}, e.g. {server.url}/https/web.archive.org/cdx/search/cdx"
+          f"?url=cnn.com&from=2020&to=2020&output=json")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
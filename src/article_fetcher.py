@@ -2,148 +2,471 @@
 Module for fetching and parsing article content.
 """
 
-import json
-import pandas as pd
-import os
-from newsplease import NewsPlease
+import re
+import time
+import codecs
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import logging
 from datetime import datetime
 
+from article_store import ArticleStore
+from metrics import ITEMS, PARSE_SECONDS, QUEUE_DEPTH, RESPONSE_BYTES, profiled
+from rate_limiter import request_with_retry
+from record_sinks import JSONLRecordSink, ParquetRecordSink, build_cleaned_record
+from seen_index import FETCHED
+from status_ledger import StatusLedger, LEDGER_FILE, PENDING, DONE, EMPTY, FAILED, DUPLICATE
+
 logger = logging.getLogger(__name__)
 
+ARTICLE_STAGE = "articles"
 
-class ArticleFetcher:
-    """Fetches article content using NewsPlease"""
+# Modules parse pool processes import once in the fork server instead of each on startup
+PARSE_PRELOAD = ["article_fetcher", "newsplease"]
+
+# Encoding declared by a <meta charset> or http-equiv Content-Type tag near the top of a page
+META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_.:-]+)', re.IGNORECASE)
+META_CHARSET_BYTES = 4096
+
+# Article bodies are cached as received under this prefix; entries without it hold re-encoded text
+RAW_CACHE_PREFIX = "raw"
+
+BOMS = [(codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')]
+
+
+def decode_html(body):
+    """Decode a downloaded page from its byte-order mark or meta charset, else UTF-8, else Windows-1252
+
+    Only the bytes are used, so a page decodes the same when it is replayed
+    from the response cache.
+    """
+    for bom, encoding in BOMS:
+        if body.startswith(bom):
+            return body.decode(encoding, errors='replace')
     
-    def __init__(self, config):
-        """Initialize with the provided configuration"""
-        self.config = config
+    match = META_CHARSET.search(body, 0, META_CHARSET_BYTES)
+    if match:
+        try:
+            return body.decode(match.group(1).decode('ascii'), errors='replace')
+        except LookupError:
+            pass
     
-    def fetch_articles(self, site_name):
-        """Fetch articles for the specified site"""
-        logger.info(f"Fetching articles for {site_name}")
-        
-        urls_file = self.config.get_site_data_path(site_name, "urls_cleaned.csv")
-        articles_file = self.config.get_site_data_path(site_name, "articles.json")
-        cleaned_articles_file = self.config.get_site_data_path(site_name, "articles_cleaned.jsonl")
+    try:
+        return body.decode('utf-8')
+    except UnicodeDecodeError:
+        # Browsers read pages labelled ISO-8859-1, or not labelled at all, as Windows-1252
+        return body.decode('cp1252', errors='replace')
+
+
+def _parse_article(body, url):
+    """Extract an article from downloaded HTML bytes, returning its serializable dict or None"""
+    # Imported on first use: NewsPlease pulls in scrapy, newspaper and elasticsearch
+    from newsplease import NewsPlease
+    article = NewsPlease.from_html(decode_html(body), url=url)
+    if not article:
+        return None
+    return article.get_serializable_dict()
+
+
+def _timed_parse(html, url):
+    """Parse an article in a pool process, returning (article_dict, seconds spent)"""
+    start = time.perf_counter()
+    return _parse_article(html, url), time.perf_counter() - start
+
+
+def _parse_pool_context():
+    """Get the multiprocessing context for parse pools, or None for the platform default
+
+    Where available, pool processes are forked from a server process that
+    has already imported NewsPlease, so each one starts without importing
+    it again and without copying the threads of the fetching process.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(PARSE_PRELOAD)
+    return context
+
+
+class ArticleOutputs:
+    """Per-site destinations of fetched articles
+
+    Bundles the raw article store, the cleaned-record sinks, the status
+    ledger and the seen-URL index, and applies each fetch result to all of
+    them. Results may come from several threads; they are applied one at a
+    time so every file keeps a single writer.
+    
+    With ``near_duplicates`` set to 'tag' or 'skip', each article's main text
+    is checked against a MinHash index of all earlier articles. Near-duplicates
+    get a ``duplicate_of`` field naming the first article of their cluster
+    ('tag'), or are marked as duplicates in the ledger and not stored ('skip').
+    """
+    
+    def __init__(self, config, site_name, parquet=False, progress_every=20, seen_urls=None, near_duplicates=None,
+                 duplicate_index=None):
+        """Open the outputs of the specified site, optionally sharing a seen-URL and near-duplicate index"""
+        if near_duplicates not in (None, 'tag', 'skip'):
+            raise ValueError(f"Unknown near-duplicate mode: {near_duplicates}")
         
-        # Initialize or create the raw articles file if it doesn't exist
-        if not os.path.exists(articles_file):
-            with open(articles_file, 'w') as f:
-                json.dump({}, f)
+        self.site_name = site_name
+        self.progress_every = progress_every
+        self.near_duplicates = near_duplicates
+        self.processed = 0
+        # URLs whose records are not durable in every sink yet
+        self.unsaved = []
+        self.lock = threading.Lock()
         
-        # Load existing articles
-        with open(articles_file, 'r') as f:
-            existing_articles = json.load(f)
-            
-        # Create or truncate the cleaned articles file
-        with open(cleaned_articles_file, 'w') as f:
-            # Just initialize an empty file
-            pass
+        # Open the raw article store, importing a legacy articles.json once
+        self.articles = ArticleStore(config.get_site_data_path(site_name, "articles_store"))
+        self.articles.migrate_from_json(config.get_site_data_path(site_name, "articles.json"))
         
-        try:
-            # Read URLs
-            df = pd.read_csv(urls_file, header=None, names=['id', 'url', 'status'])
-            urls_to_process = df[df['status'] == 'no']
+        self.ledger = StatusLedger(config.get_site_data_path(site_name, LEDGER_FILE))
+        self.owns_seen_urls = seen_urls is None
+        self.seen_urls = seen_urls or config.open_seen_index()
+        self.owns_duplicate_index = near_duplicates is not None and duplicate_index is None
+        self.duplicate_index = duplicate_index
+        if self.owns_duplicate_index:
+            self.duplicate_index = config.open_near_duplicate_index()
+        self.sinks = [JSONLRecordSink(config.get_site_data_path(site_name, "articles_cleaned.jsonl"))]
+        if parquet:
+            self.sinks.append(ParquetRecordSink(config.get_shared_data_path("articles_parquet"), site_name))
+    
+    def skip_fetched(self, urls_to_process):
+        """Pass through claimed URLs, marking those already fetched in any run or site as duplicates"""
+        for site_id, url in urls_to_process:
+            if self.seen_urls.contains(FETCHED, url):
+                logger.debug(f"Skipping article fetched before: {url}")
+                self.ledger.complete(ARTICLE_STAGE, url, DUPLICATE)
+                ITEMS.inc(site=self.site_name, stage=ARTICLE_STAGE, outcome=DUPLICATE)
+                continue
+            yield site_id, url
+    
+    def record(self, url, site_id, article_dict, error=None):
+        """Apply the result of fetching one article"""
+        with self.lock, profiled("write_outputs"):
+            if error:
+                logger.error(f"Error fetching article {url}: {error}")
+                self.ledger.fail(ARTICLE_STAGE, url, error)
+                outcome = FAILED
             
-            total_urls = len(urls_to_process)
-            logger.info(f"Found {total_urls} URLs to process for {site_name}")
+            elif article_dict and self._skip_near_duplicate(url, article_dict):
+                outcome = DUPLICATE
             
-            for index, row in urls_to_process.iterrows():
-                url = row['url']
-                site_id = row['id']
+            elif article_dict:
+                article_dict["wayback_id"] = site_id
                 
-                try:
-                    logger.info(f"Fetching article: {url}")
-                    article = NewsPlease.from_url(url, timeout=15)
-                    
-                    if article:
-                        # Convert to dictionary and add metadata
-                        article_dict = article.get_serializable_dict()
-                        article_dict["wayback_id"] = site_id
-                        
-                        # Save article to raw data
-                        existing_articles[url] = article_dict
-                        
-                        # Process article immediately and append to the JSONL file
-                        self._process_and_save_article({
-                            "title": article_dict.get("title"),
-                            "authors": article_dict.get("authors"),
-                            "url": url,
-                            "date_publish": article_dict.get("date_publish"),
-                            "description": article_dict.get("description"),
-                            "maintext": article_dict.get("maintext"),
-                            "wayback_id": site_id,
-                        }, cleaned_articles_file)
-                        
-                        # Update status
-                        df.at[index, 'status'] = 'yes'
-                        
-                        logger.info(f"Successfully fetched article: {url}")
-                    else:
-                        logger.warning(f"Failed to fetch article (no content): {url}")
-                        df.at[index, 'status'] = 'none'
+                # Save article to raw data
+                self.articles.put(url, article_dict)
                 
-                except Exception as e:
-                    logger.error(f"Error fetching article {url}: {e}")
-                    df.at[index, 'status'] = 'fail'
+                # Process article immediately and queue it on the cleaned-record sinks
+                self._process_and_save_article({
+                    "title": article_dict.get("title"),
+                    "authors": article_dict.get("authors"),
+                    "url": url,
+                    "date_publish": article_dict.get("date_publish"),
+                    "description": article_dict.get("description"),
+                    "maintext": article_dict.get("maintext"),
+                    "wayback_id": site_id,
+                    "duplicate_of": article_dict.get("duplicate_of"),
+                })
+                
+                # The status is updated once the record is durable
+                self.unsaved.append(url)
                 
-                # Periodically save progress
-                if index % 20 == 0:
-                    self._save_progress(df, urls_file, existing_articles, articles_file)
+                logger.debug(f"Successfully fetched article: {url}")
+                outcome = DONE
             
-            # Save final progress
-            self._save_progress(df, urls_file, existing_articles, articles_file)
+            else:
+                logger.warning(f"Failed to fetch article (no content): {url}")
+                self.ledger.complete(ARTICLE_STAGE, url, EMPTY)
+                outcome = EMPTY
             
-            logger.info(f"Completed article fetching for {site_name}")
+            ITEMS.inc(site=self.site_name, stage=ARTICLE_STAGE, outcome=outcome)
+            
+            # Periodically save progress
+            self.processed += 1
+            if self.processed % self.progress_every == 0:
+                self._save_progress()
+    
+    def _skip_near_duplicate(self, url, article_dict):
+        """Tag a near-duplicate article with its cluster's first URL, returning True if it is skipped instead"""
+        if self.duplicate_index is None:
+            return False
         
-        except Exception as e:
-            logger.error(f"Error processing articles for {site_name}: {e}")
+        duplicate_of = self.duplicate_index.check(url, article_dict.get("maintext"))
+        if duplicate_of is None:
+            return False
+        
+        if self.near_duplicates == 'skip':
+            logger.debug(f"Skipping near-duplicate of {duplicate_of}: {url}")
+            self.ledger.complete(ARTICLE_STAGE, url, DUPLICATE)
+            self.seen_urls.add(FETCHED, url)
+            return True
+        
+        article_dict["duplicate_of"] = duplicate_of
+        return False
     
-    def _process_and_save_article(self, article_data, output_file):
-        """Process a single article and append it to the JSONL file"""
+    def _process_and_save_article(self, article_data):
+        """Process a single article and queue it on the cleaned-record sinks"""
         try:
             # Skip articles with empty maintext
-            if not article_data.get("maintext"):
+            record = build_cleaned_record(article_data)
+            if record is None:
                 return False
-                
-            # Create a single-row DataFrame for processing
-            df = pd.DataFrame([article_data])
-            
-            # Add wayback_time column
-            df["wayback_time"] = pd.to_datetime(
-                (df["wayback_id"]).astype(str).str[:8], 
-                format='%Y%m%d', 
-                errors='coerce'
-            )
-            
-            # Add text_len column
-            df["text_len"] = df["maintext"].apply(lambda x: len(x) if x else 0)
-            
-            # Drop wayback_id column
-            df.drop(columns=["wayback_id"], inplace=True)
             
-            # Append to the JSONL file
-            with open(output_file, 'a', encoding='utf-8') as f:
-                df.to_json(f, orient='records', lines=True, force_ascii=False)
-                
+            for sink in self.sinks:
+                sink.write(record)
             return True
             
         except Exception as e:
             logger.error(f"Error processing article: {e}")
             return False
     
-    def _save_progress(self, df, urls_file, articles, articles_file):
+    def _save_progress(self, finish=False):
         """Save progress to disk"""
         try:
-            # Save updated URL statuses
-            df.to_csv(urls_file, index=False, header=False)
+            # Raw articles are appended as they arrive, so only flush them, then
+            # mark the articles whose records are durable in every sink done, so
+            # the ledger never runs ahead
+            self.articles.flush(fsync=True)
+            for sink in self.sinks:
+                sink.flush(finish=finish)
+            unfinished = set()
+            for sink in self.sinks:
+                unfinished.update(sink.unfinished_urls())
+            for url in self.unsaved:
+                if url not in unfinished:
+                    self.ledger.complete(ARTICLE_STAGE, url, DONE)
+                    self.seen_urls.add(FETCHED, url)
+            self.unsaved = [url for url in self.unsaved if url in unfinished]
+            self.seen_urls.commit()
+            if self.duplicate_index is not None:
+                self.duplicate_index.flush()
             
-            # Save raw articles
-            with open(articles_file, 'w', encoding='utf-8') as f:
-                json.dump(articles, f, ensure_ascii=False, indent=4)
+            logger.info(f"Progress saved: {len(self.articles)} raw articles")
+        
+        except Exception as e:
+            logger.error(f"Error saving progress: {e}")
+    
+    def save_progress(self, finish=False):
+        """Flush everything written so far; with ``finish``, also finish the open Parquet files"""
+        with self.lock:
+            self._save_progress(finish)
+    
+    def close(self):
+        """Flush and close all outputs"""
+        with self.lock:
+            self._save_progress(finish=True)
+            for sink in self.sinks:
+                sink.close()
+            self.articles.close()
+            self.ledger.close()
+            if self.owns_seen_urls:
+                self.seen_urls.close()
+            if self.owns_duplicate_index:
+                logger.info(f"Near-duplicate articles: {self.duplicate_index.report()}")
+                self.duplicate_index.close()
+
+
+class ArticleFetcher:
+    """Fetches article content using NewsPlease"""
+    
+    def __init__(self, config, io_workers=1, parse_workers=0, queue_size=64, timeout=15, parquet=False,
+                 near_duplicates=None):
+        """Initialize with the provided configuration
+
+        With ``io_workers`` above one or ``parse_workers`` above zero, articles
+        are downloaded on a pool of I/O threads and handed through a bounded
+        queue of ``queue_size`` pages to a process pool that runs extraction.
+        With ``parse_workers`` at zero, extraction runs on the I/O threads.
+        With ``parquet`` enabled, cleaned records are also written to Parquet
+        files partitioned by site and capture month under data/articles_parquet.
+        ``near_duplicates`` ('tag' or 'skip') handles articles whose main text
+        nearly matches an earlier one, as described in ArticleOutputs.
+        """
+        self.config = config
+        self.io_workers = max(1, io_workers)
+        self.parse_workers = parse_workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.parquet = parquet
+        self.near_duplicates = near_duplicates
+        self.cache = config.open_response_cache()
+        self.limiter = config.get_rate_limiter()
+        self.http = config.get_http_client(pool_size=self.io_workers)
+    
+    @property
+    def pooled(self):
+        """Whether articles are fetched with the worker pool"""
+        return self.io_workers > 1 or self.parse_workers > 0
+    
+    def fetch_articles(self, site_name):
+        """Fetch articles for the specified site"""
+        logger.info(f"Fetching articles for {site_name}")
+        
+        urls_file = self.config.get_site_data_path(site_name, "urls_cleaned.csv")
+        outputs = ArticleOutputs(self.config, site_name, parquet=self.parquet, near_duplicates=self.near_duplicates)
+        ledger = outputs.ledger
+        
+        try:
+            # Pick up new URLs and resume where the last run stopped
+            ledger.add_csv(ARTICLE_STAGE, urls_file, header=False)
+            ledger.release_claims(ARTICLE_STAGE)
             
-            logger.info(f"Progress saved: {len(articles)} raw articles")
+            total_urls = ledger.counts(ARTICLE_STAGE).get(PENDING, 0)
+            logger.info(f"Found {total_urls} URLs to process for {site_name}")
+            
+            urls_to_process = outputs.skip_fetched(ledger.iter_claims(ARTICLE_STAGE))
+            if self.pooled:
+                results = self._fetch_pooled(urls_to_process)
+            else:
+                results = self._fetch_serial(urls_to_process)
+            
+            for url, site_id, article_dict, error in results:
+                outputs.record(url, site_id, article_dict, error)
+            
+            # Save final progress and mirror the statuses back into the URLs file
+            outputs.save_progress(finish=True)
+            ledger.export_csv(ARTICLE_STAGE, urls_file)
+            
+            logger.info(f"Completed article fetching for {site_name}")
         
         except Exception as e:
-            logger.error(f"Error saving progress: {e}")
\ No newline at end of file
+            logger.error(f"Error processing articles for {site_name}: {e}")
+        
+        finally:
+            outputs.close()
+    
+    def fetch_article(self, url, site_id=None):
+        """Download and parse one article, returning its serializable dict or None"""
+        logger.debug(f"Fetching article: {url}")
+        with profiled("fetch_article"):
+            html = self._download(url, site_id)
+            return self._parse(html, url) if html is not None else None
+    
+    @staticmethod
+    def _parse(html, url):
+        """Parse an article in this process, timing it"""
+        with profiled("parse_article"), PARSE_SECONDS.time(stage=ARTICLE_STAGE):
+            return _parse_article(html, url)
+    
+    def _fetch_serial(self, urls_to_process):
+        """Fetch articles one at a time, yielding (url, id, article_dict, error)"""
+        for site_id, url in urls_to_process:
+            try:
+                yield url, site_id, self.fetch_article(url, site_id), None
+            
+            except Exception as e:
+                yield url, site_id, None, e
+    
+    def _download(self, url, site_id=None):
+        """Download the raw HTML bytes of an article, or None if the server did not return it"""
+        # Replay pages downloaded by earlier runs so parser changes do not refetch
+        cache_id = f"{RAW_CACHE_PREFIX}-{site_id}"
+        body = self.cache.get(url, cache_id)
+        if body is not None:
+            return body
+        
+        response = request_with_retry(self.http.get, url, limiter=self.limiter, timeout=self.timeout)
+        if response.status_code != 200:
+            logger.warning(f"Failed to download article {url}: Status {response.status_code}")
+            return None
+        
+        # Cached as received and decoded when parsed, as the header's charset is often missing or wrong
+        body = response.content
+        RESPONSE_BYTES.inc(len(body), stage=ARTICLE_STAGE)
+        self.cache.put(url, body, cache_id)
+        return body
+    
+    def _fetch_pooled(self, urls_to_process):
+        """Fetch articles with I/O threads feeding a parse pool, yielding results as they finish"""
+        work = iter(urls_to_process)
+        work_lock = threading.Lock()
+        # Bounded hand-off between download and parse stages for backpressure
+        pages = queue.Queue(maxsize=self.queue_size)
+        results = queue.Queue()
+        parse_pool = None
+        if self.parse_workers > 0:
+            parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=_parse_pool_context())
+        parse_slots = threading.Semaphore(self.parse_workers * 2 if parse_pool else 1)
+        
+        def download_worker():
+            while True:
+                with work_lock:
+                    item = next(work, None)
+                if item is None:
+                    break
+                
+                site_id, url = item
+                try:
+                    logger.debug(f"Fetching article: {url}")
+                    with profiled("fetch_article"):
+                        html = self._download(url, site_id)
+                    if html is None:
+                        results.put((url, site_id, None, None))
+                    elif parse_pool:
+                        pages.put((url, site_id, html))
+                    else:
+                        results.put((url, site_id, self._parse(html, url), None))
+                except Exception as e:
+                    results.put((url, site_id, None, e))
+            
+            # Signal that this worker has run out of URLs
+            (pages if parse_pool else results).put(None)
+        
+        def parse_dispatcher():
+            finished = 0
+            while finished < self.io_workers:
+                page = pages.get()
+                QUEUE_DEPTH.set(pages.qsize(), stage="article_pages")
+                if page is None:
+                    finished += 1
+                    continue
+                
+                url, site_id, html = page
+                parse_slots.acquire()
+                try:
+                    future = parse_pool.submit(_timed_parse, html, url)
+                except Exception as e:
+                    parse_slots.release()
+                    results.put((url, site_id, None, e))
+                    continue
+                
+                def on_parsed(future, url=url, site_id=site_id):
+                    try:
+                        article_dict, seconds = future.result()
+                        PARSE_SECONDS.observe(seconds, stage=ARTICLE_STAGE)
+                        results.put((url, site_id, article_dict, None))
+                    except Exception as e:
+                        results.put((url, site_id, None, e))
+                    finally:
+                        parse_slots.release()
+                
+                future.add_done_callback(on_parsed)
+            
+            # Wait for the parses still in flight before signalling completion
+            for _ in range(self.parse_workers * 2):
+                parse_slots.acquire()
+            results.put(None)
+        
+        threads = [threading.Thread(target=download_worker, daemon=True) for _ in range(self.io_workers)]
+        if parse_pool:
+            threads.append(threading.Thread(target=parse_dispatcher, daemon=True))
+        for thread in threads:
+            thread.start()
+        
+        try:
+            remaining = 1 if parse_pool else self.io_workers
+            while remaining:
+                result = results.get()
+                if result is None:
+                    remaining -= 1
+                    continue
+                yield result
+        finally:
+            for thread in threads:
+                thread.join()
+            if parse_pool:
+                parse_pool.shutdown()
@@ -0,0 +1,241 @@
+"""
+Module for storing raw articles in append-only segment files.
+"""
+
+import os
+import json
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "articles-"
+DATA_SUFFIX = ".jsonl"
+INDEX_SUFFIX = ".idx"
+
+
+class ArticleStore:
+    """Append-only, segment-based store of raw articles keyed by URL
+
+    Each record is one JSON line in a segment file. A sidecar ``.idx`` file
+    per segment holds ``offset<TAB>length<TAB>url`` entries, so opening the
+    store only reads the indexes and a lookup is a single seek. Writing a URL
+    again appends a new record that shadows the old one until compaction.
+    """
+
+    def __init__(self, directory, segment_size=256 * 1024 * 1024):
+        """Open the store in the given directory, creating it if needed"""
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self.index = {}
+        self.segments = sorted(self._segment_numbers())
+
+        for segment in self.segments:
+            self._load_index(segment)
+
+        self._open_active(self.segments[-1] if self.segments else 1)
+
+    def _segment_numbers(self):
+        for path in self.directory.glob(f"{SEGMENT_PREFIX}*{DATA_SUFFIX}"):
+            yield int(path.name[len(SEGMENT_PREFIX):-len(DATA_SUFFIX)])
+
+    def _data_path(self, segment):
+        return self.directory / f"{SEGMENT_PREFIX}{segment:06d}{DATA_SUFFIX}"
+
+    def _index_path(self, segment):
+        return self.directory / f"{SEGMENT_PREFIX}{segment:06d}{INDEX_SUFFIX}"
+
+    def _load_index(self, segment):
+        """Load a segment's index, recovering records written after its last entry"""
+        indexed_end = 0
+        index_path = self._index_path(segment)
+
+        if index_path.exists():
+            complete_end = 0
+            with open(index_path, 'r+b') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    offset, length, url = line.decode('utf-8').rstrip('\n').split('\t', 2)
+                    offset, length = int(offset), int(length)
+                    self.index[url] = (segment, offset, length)
+                    indexed_end = max(indexed_end, offset + length)
+                    complete_end += len(line)
+
+                # Drop a torn last entry, so new entries are not appended onto it
+                if f.seek(0, os.SEEK_END) > complete_end:
+                    logger.warning(f"Dropping a partial index entry in segment {segment}")
+                    f.truncate(complete_end)
+
+        # A crash can leave records past the index, or a partial trailing record
+        data_path = self._data_path(segment)
+        if data_path.stat().st_size > indexed_end:
+            self._recover(segment, indexed_end)
+
+    def _recover(self, segment, start):
+        """Re-index complete records after ``start`` and drop a torn trailing write"""
+        recovered = 0
+        with open(self._data_path(segment), 'r+b') as data, \
+                open(self._index_path(segment), 'a', encoding='utf-8') as index:
+            data.seek(start)
+            offset = start
+            for line in data:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    url = json.loads(line)['url']
+                except ValueError:
+                    break
+                self.index[url] = (segment, offset, len(line))
+                index.write(f"{offset}\t{len(line)}\t{url}\n")
+                offset += len(line)
+                recovered += 1
+            data.truncate(offset)
+
+        logger.info(f"Recovered {recovered} unindexed records in segment {segment}")
+
+    def _open_active(self, segment):
+        """Open a segment for appending"""
+        if segment not in self.segments:
+            self.segments.append(segment)
+        self.active = segment
+        self.data_file = open(self._data_path(segment), 'ab')
+        self.index_file = open(self._index_path(segment), 'a', encoding='utf-8')
+
+    def _roll(self):
+        """Close the active segment and start a new one"""
+        self.flush()
+        self.data_file.close()
+        self.index_file.close()
+        self._open_active(self.active + 1)
+
+    def __contains__(self, url):
+        return url in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def urls(self):
+        """Iterate over the URLs of all stored articles"""
+        return iter(self.index)
+
+    def put(self, url, article):
+        """Append an article record for the URL"""
+        line = json.dumps({'url': url, 'article': article}, ensure_ascii=False, default=str)
+        data = line.encode('utf-8') + b'\n'
+
+        if self.data_file.tell() + len(data) > self.segment_size and self.data_file.tell() > 0:
+            self._roll()
+
+        offset = self.data_file.tell()
+        self.data_file.write(data)
+        self.index_file.write(f"{offset}\t{len(data)}\t{url}\n")
+        self.index[url] = (self.active, offset, len(data))
+
+    def get(self, url, default=None):
+        """Read the latest article stored for the URL"""
+        location = self.index.get(url)
+        if location is None:
+            return default
+
+        segment, offset, length = location
+        if segment == self.active:
+            self.data_file.flush()
+        with open(self._data_path(segment), 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length))['article']
+
+    def items(self):
+        """Iterate over (url, article) pairs of the live records in storage order"""
+        self.flush()
+        live = sorted(self.index.items(), key=lambda item: item[1])
+        handle, handle_segment = None, None
+        try:
+            for url, (segment, offset, length) in live:
+                if segment != handle_segment:
+                    if handle:
+                        handle.close()
+                    handle, handle_segment = open(self._data_path(segment), 'rb'), segment
+                handle.seek(offset)
+                yield url, json.loads(handle.read(length))['article']
+        finally:
+            if handle:
+                handle.close()
+
+    def flush(self, fsync=False):
+        """Flush buffered appends, optionally forcing them to disk"""
+        self.data_file.flush()
+        self.index_file.flush()
+        if fsync:
+            os.fsync(self.data_file.fileno())
+            os.fsync(self.index_file.fileno())
+
+    def close(self):
+        """Flush and close the active segment"""
+        self.flush(fsync=True)
+        self.data_file.close()
+        self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def compact(self):
+        """Rewrite live records into fresh segments and delete the old ones"""
+        old_segments = list(self.segments)
+        records = list(sorted(self.index.items(), key=lambda item: item[1]))
+        before = sum(self._data_path(s).stat().st_size for s in old_segments)
+
+        self.flush()
+        self.data_file.close()
+        self.index_file.close()
+
+        # New segments are numbered after the old ones, so if compaction is
+        # interrupted the copies shadow the originals and nothing is lost
+        self.segments = []
+        self._open_active(old_segments[-1] + 1)
+        new_index = {}
+
+        for url, (segment, offset, length) in records:
+            with open(self._data_path(segment), 'rb') as f:
+                f.seek(offset)
+                data = f.read(length)
+
+            if self.data_file.tell() + len(data) > self.segment_size and self.data_file.tell() > 0:
+                self._roll()
+
+            new_offset = self.data_file.tell()
+            self.data_file.write(data)
+            self.index_file.write(f"{new_offset}\t{len(data)}\t{url}\n")
+            new_index[url] = (self.active, new_offset, len(data))
+
+        self.flush(fsync=True)
+        self.index = new_index
+
+        for segment in old_segments:
+            self._index_path(segment).unlink(missing_ok=True)
+            self._data_path(segment).unlink(missing_ok=True)
+
+        after = sum(self._data_path(s).stat().st_size for s in self.segments)
+        logger.info(f"Compacted article store {self.directory}: {before} -> {after} bytes")
+
+    def migrate_from_json(self, json_file):
+        """Import a legacy articles.json file once and rename it out of the way"""
+        json_file = Path(json_file)
+        if not json_file.exists():
+            return 0
+
+        with open(json_file, 'r', encoding='utf-8') as f:
+            articles = json.load(f)
+
+        for url, article in articles.items():
+            if url not in self.index:
+                self.put(url, article)
+        self.flush(fsync=True)
+
+        json_file.rename(json_file.with_name(json_file.name + ".migrated"))
+        logger.info(f"Migrated {len(articles)} articles from {json_file} to {self.directory}")
+        return len(articles)
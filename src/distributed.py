@@ -0,0 +1,333 @@
+"""
+Module for sharding the scraping work of all sites across several worker processes or nodes.
+"""
+
+import os
+import json
+import shutil
+import socket
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from article_fetcher import ArticleFetcher, ArticleOutputs, ARTICLE_STAGE
+from article_store import ArticleStore
+from status_ledger import StatusLedger, LEDGER_FILE, PENDING, CLAIMED, DONE, FAILED
+from url_extractor import URLExtractor, SNAPSHOT_STAGE
+from wayback_scraper import WaybackMachineScraper
+
+logger = logging.getLogger(__name__)
+
+# Ledger stage of the snapshot date ranges, one row per sites.json URL entry and year
+RANGE_STAGE = "ranges"
+
+# Site subdirectory holding each worker's output files until they are merged
+WORKERS_DIR = "workers"
+
+
+def range_key(link, year, collapse):
+    """Get the ledger key of a snapshot date range"""
+    return f"{year}|{collapse}|{link}"
+
+
+def parse_range_key(key):
+    """Split a range key into (link, year, collapse)"""
+    year, collapse, link = key.split('|', 2)
+    return link, int(year), collapse
+
+
+def default_worker_id():
+    """Get a worker id that is unique across the machines sharing the data directory"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkerConfig:
+    """View of a ScraperConfig that keeps one worker's output files apart
+
+    Site files other than the shared ledger resolve to
+    ``data/<site>/workers/<worker_id>/``, so no two processes append to the
+    same file. Everything else is delegated to the wrapped configuration.
+    """
+
+    def __init__(self, config, worker_id):
+        self.config = config
+        self.worker_id = worker_id
+
+    def __getattr__(self, name):
+        return getattr(self.config, name)
+
+    def get_site_data_path(self, site_name, filename):
+        """Get the path to a file in this worker's part of the site's data directory"""
+        if filename == LEDGER_FILE:
+            return self.config.get_site_data_path(site_name, filename)
+        directory = self.config.get_site_data_path(site_name, WORKERS_DIR) / self.worker_id
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory / filename
+
+    def open_seen_index(self, shared=True):
+        """Open the seen-URL index in shared mode, since other workers write to it too"""
+        return self.config.open_seen_index(shared=shared)
+
+
+def plan_shards(config, sites=None, max_attempts=3):
+    """Queue the work of the given sites for the workers; run while no workers are active
+
+    Every sites.json URL entry is split into one date range per year.
+    Snapshots and article URLs already listed in the site's CSV files are
+    queued as well, and failed rows are retried up to ``max_attempts`` times.
+    """
+    for site_name in sites or config.target_sites:
+        ledger = StatusLedger(config.get_site_data_path(site_name, LEDGER_FILE))
+        try:
+            ledger.add_csv(SNAPSHOT_STAGE, config.get_site_data_path(site_name, "urls_wayback.csv"), header=True)
+            ledger.add_csv(ARTICLE_STAGE, config.get_site_data_path(site_name, "urls_cleaned.csv"), header=False)
+
+            ranges = []
+            for url_idx, url_config in config.sites[site_name]['url'].items():
+                collapse = url_config.get('collapse', 'day')
+                for year in range(url_config['start_year'], url_config['end_year'] + 1):
+                    ranges.append((year, range_key(url_config['link'], year, collapse), PENDING))
+            added = ledger.add(RANGE_STAGE, ranges)
+
+            for stage in (RANGE_STAGE, SNAPSHOT_STAGE, ARTICLE_STAGE):
+                ledger.release_claims(stage)
+                ledger.requeue(stage, FAILED, max_attempts=max_attempts)
+
+            logger.info(f"Planned {site_name}: {added} new date ranges, "
+                        f"snapshots {ledger.counts(SNAPSHOT_STAGE)}, articles {ledger.counts(ARTICLE_STAGE)}")
+        finally:
+            ledger.close()
+
+
+def merge_worker_outputs(config, site_name):
+    """Fold every worker's output files into the site's data directory; run after the workers finish
+
+    Raw articles are added to the site's store unless another worker already
+    stored the URL, and cleaned records and extracted URLs are appended to
+    the site's files. The snapshot and article CSVs are then rewritten from
+    the ledger. Returns the number of articles merged.
+    """
+    ledger = StatusLedger(config.get_site_data_path(site_name, LEDGER_FILE))
+    try:
+        claimed = sum(ledger.counts(stage).get(CLAIMED, 0) for stage in (RANGE_STAGE, SNAPSHOT_STAGE, ARTICLE_STAGE))
+        if claimed:
+            logger.error(f"Not merging {site_name}: {claimed} rows are still claimed by workers")
+            return 0
+
+        merged = 0
+        workers_dir = config.get_site_data_path(site_name, WORKERS_DIR)
+        if workers_dir.exists():
+            store = ArticleStore(config.get_site_data_path(site_name, "articles_store"))
+            try:
+                for worker_dir in sorted(path for path in workers_dir.iterdir() if path.is_dir()):
+                    merged += _merge_worker(config, site_name, store, worker_dir)
+                    shutil.rmtree(worker_dir)
+                store.flush(fsync=True)
+            finally:
+                store.close()
+
+        ledger.export_csv(SNAPSHOT_STAGE, config.get_site_data_path(site_name, "urls_wayback.csv"),
+                          header=['timestamp', 'url', 'status'])
+        ledger.export_csv(ARTICLE_STAGE, config.get_site_data_path(site_name, "urls_cleaned.csv"))
+
+        logger.info(f"Merged {merged} articles from workers into {site_name}")
+        return merged
+    finally:
+        ledger.close()
+
+
+def _merge_worker(config, site_name, store, worker_dir):
+    """Merge one worker directory into the site's store and files"""
+    merged_urls = set()
+    if (worker_dir / "articles_store").exists():
+        worker_store = ArticleStore(worker_dir / "articles_store")
+        try:
+            for url, article in worker_store.items():
+                # A URL fetched twice after a lease expired is only kept once
+                if url not in store:
+                    store.put(url, article)
+                    merged_urls.add(url)
+        finally:
+            worker_store.close()
+
+    cleaned_file = worker_dir / "articles_cleaned.jsonl"
+    if cleaned_file.exists():
+        with open(cleaned_file, 'r', encoding='utf-8') as src, \
+                open(config.get_site_data_path(site_name, "articles_cleaned.jsonl"), 'a', encoding='utf-8') as dst:
+            for line in src:
+                if line.strip() and json.loads(line).get("url") in merged_urls:
+                    dst.write(line)
+
+    uncleaned_file = worker_dir / "urls_uncleaned.csv"
+    if uncleaned_file.exists():
+        with open(uncleaned_file, 'r', newline='') as src, \
+                open(config.get_site_data_path(site_name, "urls_uncleaned.csv"), 'a', newline='') as dst:
+            shutil.copyfileobj(src, dst)
+
+    logger.info(f"Merged {len(merged_urls)} articles from worker {worker_dir.name}")
+    return len(merged_urls)
+
+
+class ShardWorker:
+    """Worker that takes leased shards of every stage from the site ledgers until all are done
+
+    Each claim is a lease of ``lease`` seconds held for this worker's id. A
+    heartbeat thread renews the leases every ``heartbeat`` seconds, so a
+    worker that dies stops renewing and its shards go back to the others
+    once the lease runs out. Any number of workers on any number of machines
+    can share the data directory, as long as it supports SQLite locking.
+    Output files are written per worker and combined by ``merge_worker_outputs``.
+    """
+
+    def __init__(self, config, worker_id=None, sites=None, threads=8, lease=300, heartbeat=60, poll=10,
+                 parquet=False):
+        """Initialize the stages for this worker"""
+        self.worker_id = worker_id or default_worker_id()
+        self.config = WorkerConfig(config, self.worker_id)
+        self.sites = list(sites or config.target_sites)
+        self.threads = threads
+        self.lease = lease
+        self.heartbeat = heartbeat
+        self.poll = poll
+        self.parquet = parquet
+        self.stopped = threading.Event()
+
+        self.scraper = WaybackMachineScraper(self.config)
+        self.extractor = URLExtractor(self.config, concurrency=threads)
+        self.fetcher = ArticleFetcher(self.config)
+        # One keep-alive connection per thread
+        config.get_http_client(pool_size=threads)
+
+    def run(self):
+        """Work on the shards of all sites until none are pending or held by other workers"""
+        logger.info(f"Worker {self.worker_id} starting on {', '.join(self.sites)}")
+        seen_urls = self.config.open_seen_index()
+        outputs = {site_name: ArticleOutputs(self.config, site_name, parquet=self.parquet, seen_urls=seen_urls)
+                   for site_name in self.sites}
+        heartbeat = threading.Thread(target=self._heartbeat, args=(outputs,), name="heartbeat", daemon=True)
+        heartbeat.start()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="shard") as pool:
+                while not self.stopped.is_set():
+                    worked = False
+                    for site_name, site_outputs in outputs.items():
+                        worked = self._work_site(pool, site_name, site_outputs) or worked
+
+                    if not worked:
+                        # Finish open files, so the articles held back for them are marked done
+                        for site_outputs in outputs.values():
+                            site_outputs.save_progress(finish=True)
+                        if all(self._drained(site_outputs.ledger) for site_outputs in outputs.values()):
+                            break
+                        # Other workers still hold shards that may produce more work
+                        self.stopped.wait(self.poll)
+
+        finally:
+            self.stopped.set()
+            heartbeat.join()
+            for site_outputs in outputs.values():
+                for stage in (RANGE_STAGE, SNAPSHOT_STAGE, ARTICLE_STAGE):
+                    site_outputs.ledger.release_claims(stage, self.worker_id)
+                site_outputs.close()
+            seen_urls.close()
+            logger.info(f"Worker {self.worker_id} finished")
+
+    def stop(self):
+        """Ask the worker to stop after the current batch"""
+        self.stopped.set()
+
+    def _heartbeat(self, outputs):
+        """Renew this worker's leases until it stops"""
+        while not self.stopped.wait(self.heartbeat):
+            for site_outputs in outputs.values():
+                try:
+                    site_outputs.ledger.renew(self.worker_id, self.lease)
+                except Exception as e:
+                    logger.error(f"Error renewing leases of {self.worker_id}: {e}")
+
+    @staticmethod
+    def _drained(ledger):
+        """Check whether a site has no pending or claimed rows in any stage"""
+        for stage in (RANGE_STAGE, SNAPSHOT_STAGE, ARTICLE_STAGE):
+            counts = ledger.counts(stage)
+            if counts.get(PENDING) or counts.get(CLAIMED):
+                return False
+        return True
+
+    def _work_site(self, pool, site_name, outputs):
+        """Process one batch of the site's most downstream pending stage, returning whether there was any"""
+        ledger = outputs.ledger
+
+        # Later stages go first so work in progress stays bounded
+        rows = ledger.claim(ARTICLE_STAGE, self.threads, self.worker_id, self.lease)
+        if rows:
+            rows = list(outputs.skip_fetched(rows))
+            list(pool.map(lambda row: self._process_article(outputs, *row), rows))
+            # Articles only count as done once their records are durable
+            outputs.save_progress()
+            return True
+
+        rows = ledger.claim(SNAPSHOT_STAGE, self.threads, self.worker_id, self.lease)
+        if rows:
+            base_url = self.config.sites[site_name]['base_url']
+            uncleaned_file = self.config.get_site_data_path(site_name, "urls_uncleaned.csv")
+            write_lock = threading.Lock()
+            list(pool.map(lambda row: self._process_snapshot(site_name, outputs, base_url, uncleaned_file,
+                                                             write_lock, *row), rows))
+            return True
+
+        rows = ledger.claim(RANGE_STAGE, 1, self.worker_id, self.lease)
+        if rows:
+            self._process_range(ledger, *rows[0])
+            return True
+
+        return False
+
+    def _process_range(self, ledger, year, key):
+        """Queue the snapshots of one date range"""
+        link, year, collapse = parse_range_key(key)
+        try:
+            batch = []
+            for snapshot_timestamp, snapshot_url in self.scraper.iter_cdx_site(link, year, year, collapse,
+                                                                                raise_errors=True):
+                batch.append((int(snapshot_timestamp), snapshot_url, PENDING))
+                if len(batch) >= 1000:
+                    ledger.add(SNAPSHOT_STAGE, batch)
+                    batch = []
+            ledger.add(SNAPSHOT_STAGE, batch)
+            ledger.complete(RANGE_STAGE, key, DONE, self.worker_id)
+
+        except Exception as e:
+            logger.error(f"Error listing snapshots for {link} in {year}: {e}")
+            ledger.fail(RANGE_STAGE, key, e, self.worker_id)
+
+    def _process_snapshot(self, site_name, outputs, base_url, uncleaned_file, write_lock, snapshot_id, snapshot_url):
+        """Extract a snapshot's article URLs and queue the new ones"""
+        ledger = outputs.ledger
+        try:
+            article_urls = self.extractor.process_snapshot(snapshot_url, snapshot_id, base_url, site_name)
+            if article_urls is None:
+                ledger.fail(SNAPSHOT_STAGE, snapshot_url, "fetch failed", self.worker_id)
+                return
+
+            # The new URLs are queued in the ledger before they count as seen, so a
+            # requeued snapshot never finds its URLs seen but missing from the queue
+            with write_lock:
+                self.extractor.save_links(
+                    article_urls, uncleaned_file, snapshot_id, outputs.seen_urls,
+                    queue=lambda urls: ledger.add(ARTICLE_STAGE, [(snapshot_id, url, PENDING) for url in urls]))
+            ledger.complete(SNAPSHOT_STAGE, snapshot_url, DONE, self.worker_id)
+
+        except Exception as e:
+            logger.error(f"Error processing snapshot {snapshot_url}: {e}")
+            ledger.fail(SNAPSHOT_STAGE, snapshot_url, e, self.worker_id)
+
+    def _process_article(self, outputs, site_id, url):
+        """Fetch one article and record the result"""
+        try:
+            article_dict = self.fetcher.fetch_article(url, site_id)
+        except Exception as e:
+            outputs.record(url, site_id, None, e)
+        else:
+            outputs.record(url, site_id, article_dict)
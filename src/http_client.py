@@ -0,0 +1,131 @@
+"""
+Module for the pooled HTTP clients shared by all fetchers.
+"""
+
+import logging
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - httpx is optional
+    httpx = None
+
+try:
+    import brotli  # noqa: F401 - lets urllib3 decode brotli bodies
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:  # pragma: no cover - brotli is optional
+    ACCEPT_ENCODING = "gzip, deflate"
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 16
+
+
+class HTTPXResponse:
+    """Minimal requests-style view of an httpx response, covering what the fetchers use"""
+
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    @property
+    def content(self):
+        return self.response.read()
+
+    @property
+    def text(self):
+        self.response.read()
+        return self.response.text
+
+    def iter_content(self, chunk_size=None):
+        return self.response.iter_bytes(chunk_size)
+
+    def close(self):
+        self.response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HTTPClient:
+    """Thread-safe HTTP client that keeps connections to each host alive across requests
+
+    Worker threads share one requests Session whose pools keep up to
+    ``pool_size`` connections per host open, so TCP and TLS handshakes are
+    paid once per connection rather than once per request. ``proxies`` (a
+    requests-style scheme to proxy URL mapping) applies to every request.
+    Bodies are requested gzip or brotli compressed and decoded transparently.
+    With ``http2`` set and httpx installed with HTTP/2 support, requests are
+    multiplexed over HTTP/2 connections instead.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, proxies=None, http2=False):
+        """Open the connection pools"""
+        self.pool_size = pool_size
+        self.proxies = proxies or {}
+        self.http2_client = self._open_http2() if http2 else None
+
+        self.session = requests.Session()
+        self.session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        self.session.proxies.update(self.proxies)
+        self._mount(pool_size)
+
+    def _mount(self, pool_size):
+        # Retries are left to request_with_retry, which also paces them
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.pool_size = pool_size
+
+    def _open_http2(self):
+        """Open an HTTP/2 client, or return None if httpx or h2 is missing"""
+        if httpx is None:
+            logger.warning("httpx is not installed, falling back to HTTP/1.1")
+            return None
+
+        proxy = self.proxies.get("https") or self.proxies.get("http")
+        try:
+            return httpx.Client(
+                http2=True,
+                proxy=proxy,
+                follow_redirects=True,
+                headers={'Accept-Encoding': ACCEPT_ENCODING},
+                limits=httpx.Limits(max_connections=None, max_keepalive_connections=self.pool_size),
+            )
+        except ImportError as e:
+            logger.warning(f"HTTP/2 support is not available ({e}), falling back to HTTP/1.1")
+            return None
+
+    def ensure_pool_size(self, pool_size):
+        """Grow the per-host connection pools to hold at least ``pool_size`` connections"""
+        if pool_size > self.pool_size:
+            self._mount(pool_size)
+
+    def proxy_for(self, url):
+        """Get the proxy URL requests to the given URL go through, or None"""
+        return self.proxies.get(urlparse(url).scheme)
+
+    def get(self, url, params=None, timeout=None, stream=False, headers=None):
+        """Send a GET request, returning a requests-style response"""
+        if self.http2_client is not None:
+            request = self.http2_client.build_request("GET", url, params=params, headers=headers, timeout=timeout)
+            return HTTPXResponse(self.http2_client.send(request, stream=stream))
+        return self.session.get(url, params=params, timeout=timeout, stream=stream, headers=headers)
+
+    def close(self):
+        """Close all pooled connections"""
+        self.session.close()
+        if self.http2_client is not None:
+            self.http2_client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,56 @@
+"""
+Module for normalizing and filtering batches of extracted links.
+"""
+
+import re
+
+# /web/<timestamp>[modifier]/ prefix of Wayback Machine rewritten links,
+# optionally with the archive host in front
+WAYBACK_PREFIX = re.compile(r'^(?:https?://(?:web\.)?archive\.org)?/web/\d+[a-z_]*/', re.IGNORECASE)
+# Everything from the first embedded http(s) URL onward
+EMBEDDED_URL = re.compile(r'(https?:/+.*)$', re.IGNORECASE)
+# Scheme and host, with any collapsed slashes and default port
+SCHEME_HOST = re.compile(r'^https?:/+([^/?#:]+)(?::(?:80|443))?(?=[/?#]|$)', re.IGNORECASE)
+QUERY_FRAGMENT = re.compile(r'[?#].*$')
+TRAILING_SLASHES = re.compile(r'(?<=[^/])/+$')
+
+MIN_URL_LENGTH = 10
+
+
+def normalize_links(links):
+    """Canonicalize a batch of raw hrefs, returning a Series of URLs (None where unusable)
+
+    Strips the Wayback prefix, keeps the embedded original URL, forces https
+    and a lower-case host, and drops query strings, fragments and trailing
+    slashes so variants of the same article collapse to one URL.
+    """
+    # Imported on first use, so importing the pipeline does not load pandas
+    import pandas as pd
+
+    urls = pd.Series(links, dtype=object)
+    urls = urls[urls.str.len() >= MIN_URL_LENGTH]
+
+    urls = urls.str.replace(WAYBACK_PREFIX, '', regex=True)
+    urls = urls.str.extract(EMBEDDED_URL, expand=False)
+    urls = urls.str.replace(QUERY_FRAGMENT, '', regex=True)
+    urls = urls.str.replace(SCHEME_HOST, lambda m: f"https://{m.group(1).lower()}", regex=True)
+    urls = urls.str.replace(TRAILING_SLASHES, '', regex=True)
+    return urls
+
+
+def filter_links(urls, base_url):
+    """Keep unique URLs on the site's base URL, dropping videos and short URLs"""
+    urls = urls.dropna()
+    keep = (
+        urls.str.contains(base_url, regex=False)
+        & ~urls.str.contains('/video/', regex=False)
+        & (urls.str.len() >= MIN_URL_LENGTH)
+    )
+    return urls[keep].drop_duplicates()
+
+
+def clean_links(links, base_url):
+    """Normalize and filter one batch of raw hrefs into a list of canonical article URLs"""
+    if not links:
+        return []
+    return filter_links(normalize_links(links), base_url).tolist()
@@ -0,0 +1,70 @@
+"""
+Module for pulling link targets out of snapshot HTML.
+"""
+
+import logging
+
+try:
+    from lxml import etree
+except ImportError:  # pragma: no cover - lxml is optional
+    etree = None
+
+logger = logging.getLogger(__name__)
+
+
+def extract_hrefs_soup(html):
+    """Collect <a href> values by building a full BeautifulSoup tree"""
+    # Only the fallback path needs it, so it is imported on first use
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    return [a.get('href') for a in soup.find_all('a', href=True)]
+
+
+def _collect_hrefs(parser, links):
+    """Take the anchors of the elements parsed so far, pruning each finished element from the tree"""
+    for _, element in parser.read_events():
+        if element.tag == 'a':
+            href = element.get('href')
+            if href:
+                links.append(href)
+        # Drop the element's content and the finished siblings before it,
+        # so the tree only holds the path to the element being parsed
+        element.clear()
+        parent = element.getparent()
+        if parent is not None:
+            while element.getprevious() is not None:
+                del parent[0]
+
+
+def extract_hrefs(chunks):
+    """Collect <a href> values from an iterable of raw HTML byte chunks
+
+    The bytes are fed to lxml's incremental parser as they arrive. Every
+    element is cleared and removed from the tree once it has been parsed,
+    so the tree stays as small as the nesting depth of the page, and the
+    body is never decoded to text. The raw bytes are still buffered, so
+    that pages lxml cannot parse, or every page when lxml is missing, can
+    fall back to BeautifulSoup.
+    """
+    buffered = []
+
+    if etree is not None:
+        parser = etree.HTMLPullParser(events=('end',))
+        links = []
+        try:
+            for chunk in chunks:
+                buffered.append(chunk)
+                parser.feed(chunk)
+                _collect_hrefs(parser, links)
+            parser.close()
+            _collect_hrefs(parser, links)
+            return links
+
+        except etree.LxmlError as e:
+            logger.debug(f"Falling back to BeautifulSoup after lxml error: {e}")
+            buffered.extend(chunks)
+
+    else:
+        buffered.extend(chunks)
+
+    return extract_hrefs_soup(b''.join(buffered))
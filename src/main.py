@@ -0,0 +1,127 @@
+"""
+Main entry point that runs the whole scraping pipeline for the target sites.
+"""
+
+import time
+import logging
+import argparse
+from pathlib import Path
+
+from config import ScraperConfig
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """Parse the command line options"""
+    parser = argparse.ArgumentParser(description="Scrape news articles from the Wayback Machine")
+    parser.add_argument("--sites", nargs="+", help="Sites to scrape (default: all target sites)")
+    parser.add_argument("--parquet", action="store_true", help="Also write cleaned articles as Parquet")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-json", type=Path, help="Periodically write metrics as JSON to this file")
+    parser.add_argument("--metrics-interval", type=float, default=30, help="Seconds between JSON metric dumps")
+    parser.add_argument("--profile", type=Path,
+                        help="Sample where wall time goes and write collapsed stacks to this file")
+    commands = parser.add_subparsers(dest="command")
+    
+    run = commands.add_parser("run", help="Run the pipeline in this process (the default)")
+    run.add_argument("--snapshot-workers", type=int, default=8, help="Concurrent snapshot downloads")
+    run.add_argument("--article-workers", type=int, default=16, help="Concurrent article downloads")
+    run.add_argument("--max-pending", type=int, default=256, help="Queued tasks allowed per stage")
+    run.add_argument("--incremental", action="store_true",
+                     help="Only query snapshot dates not covered by earlier runs")
+    run.add_argument("--near-duplicates", choices=("tag", "skip"),
+                     help="Tag or skip articles whose text nearly matches an earlier article")
+    
+    commands.add_parser("plan", help="Queue the sites' work for distributed workers")
+    
+    work = commands.add_parser("work", help="Process queued work as one distributed worker")
+    work.add_argument("--worker-id", help="Unique worker name (default: host and process id)")
+    work.add_argument("--threads", type=int, default=8, help="Concurrent downloads in this worker")
+    work.add_argument("--lease", type=float, default=300, help="Seconds a claimed shard is held without a heartbeat")
+    work.add_argument("--heartbeat", type=float, default=60, help="Seconds between lease renewals")
+    
+    commands.add_parser("merge", help="Merge the workers' output files into the site data directories")
+    
+    index = commands.add_parser("index", help="Update the keyword index of each site's cleaned articles")
+    index.add_argument("--workers", type=int, help="Tokenizer processes (default: one per CPU)")
+    
+    args = parser.parse_args()
+    if args.command is None:
+        args = parser.parse_args(["run"], namespace=args)
+    return args
+
+
+def start_instrumentation(args):
+    """Start the metric exporters and profiler requested on the command line"""
+    from metrics import MetricsServer, JSONMetricsDumper, SamplingProfiler
+    
+    running = []
+    if args.metrics_port:
+        running.append(MetricsServer(args.metrics_port).start())
+    if args.metrics_json:
+        running.append(JSONMetricsDumper(args.metrics_json, args.metrics_interval).start())
+    if args.profile:
+        running.append(SamplingProfiler().start())
+    return running
+
+
+def stop_instrumentation(running, args):
+    """Stop the exporters, writing out the final metrics and the profile"""
+    for instrument in running:
+        instrument.stop()
+        if args.profile and hasattr(instrument, "write_collapsed"):
+            instrument.write_collapsed(args.profile)
+            logger.info(f"Profile written to {args.profile}\n{instrument.report()}")
+
+
+def main():
+    args = parse_args()
+    config = ScraperConfig()
+    running = start_instrumentation(args)
+    start = time.time()
+    
+    try:
+        run_command(args, config)
+    finally:
+        stop_instrumentation(running, args)
+    
+    logger.info(f"Command {args.command} completed in {time.time() - start:.2f} seconds")
+
+
+def run_command(args, config):
+    """Run the selected command"""
+    if args.command == "run":
+        from orchestrator import PipelineOrchestrator
+        orchestrator = PipelineOrchestrator(
+            config,
+            snapshot_workers=args.snapshot_workers,
+            article_workers=args.article_workers,
+            max_pending=args.max_pending,
+            parquet=args.parquet,
+            incremental=args.incremental,
+            near_duplicates=args.near_duplicates,
+        )
+        orchestrator.run(args.sites)
+    
+    elif args.command == "index":
+        from preprocess.keyword_index import build_site_index
+        for site_name in args.sites or config.target_sites:
+            build_site_index(config, site_name, workers=args.workers)
+    
+    else:
+        # The distributed mode is only imported when used
+        from distributed import plan_shards, merge_worker_outputs, ShardWorker
+        
+        if args.command == "plan":
+            plan_shards(config, args.sites)
+        elif args.command == "work":
+            ShardWorker(config, worker_id=args.worker_id, sites=args.sites, threads=args.threads,
+                        lease=args.lease, heartbeat=args.heartbeat, parquet=args.parquet).run()
+        elif args.command == "merge":
+            for site_name in args.sites or config.target_sites:
+                merge_worker_outputs(config, site_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+"""
+Module for pipeline metrics and an opt-in sampling profiler.
+"""
+
+import sys
+import json
+import time
+import threading
+import logging
+from bisect import bisect_left
+from collections import Counter as TallyCounter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    """Base of the metric families: one value per combination of label values"""
+
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self):
+        """Get (label values, value) pairs"""
+        with self.lock:
+            return list(self.values.items())
+
+    def render(self):
+        """Get the metric in the Prometheus text exposition format"""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self.samples():
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+    def to_dict(self):
+        return {
+            "type": self.kind,
+            "help": self.help,
+            "values": [{"labels": dict(zip(self.labels, key)), "value": value} for key, value in self.samples()],
+        }
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that goes up and down, set directly or read from a callback at collection time"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), callback=None):
+        super().__init__(name, help_text, labels)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.callback is None:
+            return super().samples()
+        try:
+            return [(tuple(str(value) for value in key), value) for key, value in self.callback().items()]
+        except Exception as e:
+            logger.error(f"Error collecting gauge {self.name}: {e}")
+            return []
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self.lock:
+            return [(key, (list(counts), total, count)) for key, (counts, total, count) in self.values.items()]
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of a block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, (counts, total, count) in self.samples():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+    def to_dict(self):
+        return {
+            "type": self.kind,
+            "help": self.help,
+            "buckets": list(self.buckets),
+            "values": [{"labels": dict(zip(self.labels, key)), "counts": counts, "sum": total, "count": count}
+                       for key, (counts, total, count) in self.samples()],
+        }
+
+
+class MetricsRegistry:
+    """Named collection of metrics, rendered as Prometheus text or JSON"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=(), callback=None):
+        return self._register(Gauge(name, help_text, labels, callback))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        """Get all metrics in the Prometheus text exposition format"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+    def to_dict(self):
+        """Get all metrics as a JSON-serializable dict"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {"time": time.time(), "metrics": {metric.name: metric.to_dict() for metric in metrics}}
+
+
+# Registry the pipeline records into
+registry = MetricsRegistry()
+
+HTTP_REQUESTS = registry.counter(
+    "scraper_http_requests_total", "HTTP responses by host and status code (status 0 is a connection error)",
+    ("host", "status"))
+HTTP_LATENCY = registry.histogram(
+    "scraper_http_request_seconds", "Time to response headers per host", ("host",))
+RESPONSE_BYTES = registry.counter(
+    "scraper_response_bytes_total", "Response body bytes downloaded per stage", ("stage",))
+PARSE_SECONDS = registry.histogram(
+    "scraper_parse_seconds", "Time spent parsing a downloaded page per stage", ("stage",))
+ITEMS = registry.counter(
+    "scraper_items_total", "Processed snapshots and articles by site, stage and outcome", ("site", "stage", "outcome"))
+QUEUE_DEPTH = registry.gauge(
+    "scraper_queue_depth", "Items queued or in flight per stage", ("stage",))
+
+
+class MetricsServer:
+    """Serves the registry in the Prometheus text format on ``/metrics`` from a daemon thread"""
+
+    def __init__(self, port, host="0.0.0.0", metrics_registry=registry):
+        metrics = metrics_registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logger.info(f"Serving metrics on port {self.server.server_address[1]}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class JSONMetricsDumper:
+    """Periodically writes the registry as JSON to a file, replacing it atomically"""
+
+    def __init__(self, path, interval=30.0, metrics_registry=registry):
+        self.path = path
+        self.interval = interval
+        self.registry = metrics_registry
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="metrics-dumper", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        """Write the current metrics to the file"""
+        try:
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            tmp_path.write_text(json.dumps(self.registry.to_dict(), indent=1))
+            tmp_path.replace(self.path)
+        except Exception as e:
+            logger.error(f"Error writing metrics to {self.path}: {e}")
+
+    def stop(self):
+        """Stop dumping, writing the final metrics once more"""
+        self.stopped.set()
+        self.thread.join()
+        self.dump()
+
+
+class SamplingProfiler:
+    """Statistical profiler of the code running inside ``profiled`` sections
+
+    A background thread samples the stacks of all threads every ``interval``
+    seconds and keeps those of threads inside a profiled section. Sample
+    counts per section approximate its share of wall time, and the collapsed
+    stacks can be fed to flame graph tools. Only threads of this process are
+    sampled, not process pool workers. Sections cost a dict update while a
+    profiler is running and nothing otherwise.
+    """
+
+    def __init__(self, interval=0.005, max_depth=40):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.sections = TallyCounter()
+        self.stacks = TallyCounter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        global active_profiler
+        active_profiler = self
+        self.thread.start()
+        return self
+
+    def stop(self):
+        global active_profiler
+        self.stopped.set()
+        self.thread.join()
+        active_profiler = None
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.samples += 1
+            frames = sys._current_frames()
+            for thread_id, section in list(_thread_sections.items()):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                self.sections[section] += 1
+                self.stacks[(section,) + self._stack(frame)] += 1
+
+    def _stack(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+    def report(self, top=15):
+        """Get a text summary of the sampled wall time per section and the hottest stacks"""
+        lines = [f"{self.samples} samples at {self.interval * 1000:.0f} ms"]
+        for section, count in self.sections.most_common():
+            lines.append(f"  {section:30s} {count * self.interval:9.2f} s wall (summed over threads)")
+        lines.append("Hottest stacks:")
+        for stack, count in self.stacks.most_common(top):
+            lines.append(f"  {count:6d}  {stack[0]}: {stack[-1]}")
+        return "\n".join(lines)
+
+    def write_collapsed(self, path):
+        """Write the samples in the collapsed-stack format used by flame graph tools"""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(";".join(stack) + f" {count}\n")
+
+
+# Section each thread is in while a profiler runs
+_thread_sections = {}
+active_profiler = None
+
+
+@contextmanager
+def profiled(section):
+    """Mark a block as a named section for the sampling profiler, if one is running"""
+    if active_profiler is None:
+        yield
+        return
+
+    thread_id = threading.get_ident()
+    outer = _thread_sections.get(thread_id)
+    _thread_sections[thread_id] = section
+    try:
+        yield
+    finally:
+        if outer is None:
+            _thread_sections.pop(thread_id, None)
+        else:
+            _thread_sections[thread_id] = outer
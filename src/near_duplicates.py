@@ -0,0 +1,281 @@
+"""
+Module for detecting near-duplicate articles with MinHash signatures and LSH.
+"""
+
+import re
+import json
+import zlib
+import threading
+import logging
+from pathlib import Path
+from collections import Counter
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+META_FILE = "meta.json"
+SIGNATURES_FILE = "signatures.bin"
+CLUSTERS_FILE = "clusters.bin"
+URLS_FILE = "urls.txt"
+
+# Largest Mersenne prime below 2**64, for the universal hash functions of the permutations
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64(0xFFFFFFFF)
+
+WORD = re.compile(r"\w+")
+
+
+def shingle_hashes(text, size):
+    """Get the 32-bit hashes of the distinct ``size``-word shingles of a text"""
+    words = WORD.findall(text.lower())
+    if len(words) <= size:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[start:start + size]) for start in range(len(words) - size + 1)}
+    return np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=np.uint64,
+                       count=len(shingles))
+
+
+class NearDuplicateIndex:
+    """Persistent MinHash/LSH index that groups articles with nearly the same main text
+
+    Each text gets a MinHash signature of ``num_perm`` 32-bit values over
+    its word shingles. Two signatures agree in about the same share of
+    positions as the Jaccard similarity of the texts' shingle sets. The
+    signature is split into ``bands``; texts sharing any whole band are
+    candidates, and a candidate whose estimated similarity reaches
+    ``threshold`` makes the text a duplicate, joining the candidate's cluster.
+
+    Only cluster representatives (the first text of each cluster) are in the
+    band tables. Each band is a sorted array of 32-bit band hashes searched
+    by bisection, plus a small dict of recent additions that is merged in
+    periodically, so lookups stay logarithmic as the corpus grows. Memory
+    is about ``num_perm * 4 + bands * 8`` bytes per article. Signatures,
+    cluster ids and URLs are appended to files in ``directory`` and shared
+    by all sites and runs.
+    """
+
+    def __init__(self, directory, num_perm=64, bands=8, threshold=0.8, shingle_size=5, merge_every=50_000,
+                 seed=1):
+        """Open or create the index in the given directory"""
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.threshold = threshold
+        self.merge_every = merge_every
+        self.lock = threading.Lock()
+        self._open_meta(num_perm=num_perm, bands=bands, shingle_size=shingle_size, seed=seed)
+
+        # Parameters of the hash functions that stand in for the permutations
+        generator = np.random.RandomState(self.seed)
+        self.perm_a = self._random_uint64(generator, self.num_perm) % MERSENNE_PRIME | np.uint64(1)
+        self.perm_b = self._random_uint64(generator, self.num_perm) % MERSENNE_PRIME
+        # Odd multipliers that fold each band's values into one hash
+        self.band_multipliers = self._random_uint64(generator, self.rows) | np.uint64(1)
+
+        self._load()
+
+    @staticmethod
+    def _random_uint64(generator, size):
+        return generator.randint(0, np.iinfo(np.int64).max, size=size, dtype=np.int64).astype(np.uint64)
+
+    def _open_meta(self, **settings):
+        """Read the index settings, or record the given ones for a new index"""
+        meta_path = self.directory / META_FILE
+        if meta_path.exists():
+            with open(meta_path, 'r') as f:
+                stored = json.load(f)
+            if stored != settings:
+                logger.warning(f"Near-duplicate index in {self.directory} uses {stored}, not {settings}")
+            settings = stored
+        else:
+            with open(meta_path, 'w') as f:
+                json.dump(settings, f)
+
+        self.num_perm = settings['num_perm']
+        self.bands = settings['bands']
+        self.rows = self.num_perm // self.bands
+        self.shingle_size = settings['shingle_size']
+        self.seed = settings['seed']
+
+    def _load(self):
+        """Load the stored signatures, clusters and URLs and build the band tables"""
+        signatures_path = self.directory / SIGNATURES_FILE
+        clusters_path = self.directory / CLUSTERS_FILE
+        urls_path = self.directory / URLS_FILE
+
+        empty = np.zeros(0, dtype=np.uint32)
+        signatures = np.fromfile(signatures_path, dtype=np.uint32) if signatures_path.exists() else empty
+        clusters = np.fromfile(clusters_path, dtype=np.uint32) if clusters_path.exists() else empty
+        urls = urls_path.read_text(encoding='utf-8').splitlines() if urls_path.exists() else []
+
+        # An interrupted write may leave the files at different lengths; keep the entries all three have
+        count = min(len(signatures) // self.num_perm, len(clusters), len(urls))
+        self.signatures = np.zeros((max(1024, count * 2), self.num_perm), dtype=np.uint32)
+        self.signatures[:count] = signatures[:count * self.num_perm].reshape(count, self.num_perm)
+        self.clusters = np.zeros(max(1024, count * 2), dtype=np.uint32)
+        self.clusters[:count] = clusters[:count]
+        self.urls = urls[:count]
+        self.count = count
+        # First id of each URL, so a text checked again is not its own duplicate
+        self.ids = {}
+        for doc_id, url in enumerate(self.urls):
+            self.ids.setdefault(url, doc_id)
+
+        if len(signatures) != count * self.num_perm or len(clusters) != count or len(urls) != count:
+            logger.warning(f"Dropping incomplete near-duplicate entries past {count} in {self.directory}")
+            with open(signatures_path, 'ab') as f:
+                f.truncate(count * self.num_perm * 4)
+            with open(clusters_path, 'ab') as f:
+                f.truncate(count * 4)
+            with open(urls_path, 'w', encoding='utf-8') as f:
+                f.writelines(f"{url}\n" for url in self.urls)
+
+        self.signature_file = open(signatures_path, 'ab')
+        self.cluster_file = open(clusters_path, 'ab')
+        self.url_file = open(urls_path, 'a', encoding='utf-8')
+
+        representatives = np.flatnonzero(self.clusters[:count] == np.arange(count)).astype(np.uint32)
+        keys = self._band_keys(self.signatures[representatives])
+        order = np.argsort(keys, axis=0, kind='stable')
+        self.band_keys = [keys[order[:, band], band] for band in range(self.bands)]
+        self.band_ids = [representatives[order[:, band]] for band in range(self.bands)]
+        self.recent = [{} for _ in range(self.bands)]
+        self.recent_count = 0
+
+        logger.info(f"Loaded near-duplicate index with {count} articles in {len(representatives)} clusters")
+
+    def __len__(self):
+        return self.count
+
+    def _band_keys(self, signatures):
+        """Get the 32-bit hash of each band of each signature, as a (signatures, bands) array"""
+        bands = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        return ((bands * self.band_multipliers).sum(axis=2, dtype=np.uint64) >> np.uint64(32)).astype(np.uint32)
+
+    def signature(self, text):
+        """Get the MinHash signature of a text"""
+        hashes = shingle_hashes(text, self.shingle_size)
+        permuted = (hashes[:, None] * self.perm_a + self.perm_b) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _candidates(self, keys):
+        """Get the representatives sharing at least one band with a signature's band keys"""
+        candidates = set()
+        for band, key in enumerate(keys.tolist()):
+            band_keys = self.band_keys[band]
+            start = np.searchsorted(band_keys, key, side='left')
+            end = np.searchsorted(band_keys, key, side='right')
+            candidates.update(self.band_ids[band][start:end].tolist())
+            candidates.update(self.recent[band].get(key, ()))
+        return candidates
+
+    def find(self, signature):
+        """Get the cluster of the most similar stored text at or above the threshold, or None"""
+        keys = self._band_keys(signature[None, :])[0]
+        best, best_similarity = None, self.threshold
+        for candidate in self._candidates(keys):
+            similarity = np.count_nonzero(self.signatures[candidate] == signature) / self.num_perm
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return None if best is None else int(self.clusters[best])
+
+    def check(self, url, text):
+        """Add a text, returning the URL of the cluster it duplicates or None if it is new
+
+        A URL checked before, such as an article fetched again, keeps the
+        answer it got the first time instead of matching its own entry.
+        """
+        if not text:
+            return None
+
+        signature = self.signature(text)
+        with self.lock:
+            doc_id = self.ids.get(url)
+            if doc_id is not None:
+                cluster = int(self.clusters[doc_id])
+                return None if cluster == doc_id else self.urls[cluster]
+
+            cluster = self.find(signature)
+            doc_id = self._append(url, signature, self.count if cluster is None else cluster)
+            if cluster is None:
+                self._index(doc_id, signature)
+                return None
+            return self.urls[cluster]
+
+    def _append(self, url, signature, cluster):
+        """Store a signature with its cluster and URL, returning its id"""
+        doc_id = self.count
+        if doc_id == len(self.signatures):
+            self.signatures = np.concatenate([self.signatures, np.zeros_like(self.signatures)])
+            self.clusters = np.concatenate([self.clusters, np.zeros_like(self.clusters)])
+
+        self.signatures[doc_id] = signature
+        self.clusters[doc_id] = cluster
+        self.urls.append(url)
+        self.ids.setdefault(url, doc_id)
+        self.count += 1
+
+        self.signature_file.write(signature.tobytes())
+        self.cluster_file.write(np.uint32(cluster).tobytes())
+        self.url_file.write(f"{url}\n")
+        return doc_id
+
+    def _index(self, doc_id, signature):
+        """Add a cluster representative to the band tables"""
+        for band, key in enumerate(self._band_keys(signature[None, :])[0].tolist()):
+            self.recent[band].setdefault(key, []).append(doc_id)
+        self.recent_count += 1
+        if self.recent_count >= self.merge_every:
+            self._merge_recent()
+
+    def _merge_recent(self):
+        """Merge the recently indexed representatives into the sorted band arrays"""
+        for band, recent in enumerate(self.recent):
+            keys = np.fromiter((key for key, ids in recent.items() for _ in ids), dtype=np.uint32)
+            ids = np.fromiter((doc_id for doc_ids in recent.values() for doc_id in doc_ids), dtype=np.uint32)
+            keys = np.concatenate([self.band_keys[band], keys])
+            ids = np.concatenate([self.band_ids[band], ids])
+            order = np.argsort(keys, kind='stable')
+            self.band_keys[band], self.band_ids[band] = keys[order], ids[order]
+        self.recent = [{} for _ in range(self.bands)]
+        self.recent_count = 0
+
+    def cluster_sizes(self):
+        """Get a Counter of cluster size to the number of clusters of that size"""
+        with self.lock:
+            sizes = np.bincount(self.clusters[:self.count])
+        values, counts = np.unique(sizes[sizes > 0], return_counts=True)
+        return Counter(dict(zip(values.tolist(), counts.tolist())))
+
+    def largest_clusters(self, limit=10):
+        """Get (representative URL, size) pairs of the largest clusters"""
+        with self.lock:
+            sizes = np.bincount(self.clusters[:self.count])
+        largest = np.argsort(sizes, kind='stable')[::-1][:limit]
+        return [(self.urls[cluster], int(sizes[cluster])) for cluster in largest if sizes[cluster] > 1]
+
+    def report(self, limit=5):
+        """Get a one-paragraph summary of the clusters"""
+        sizes = self.cluster_sizes()
+        clusters = sum(sizes.values())
+        duplicates = self.count - clusters
+        lines = [f"{duplicates} of {self.count} articles are near-duplicates, in "
+                 f"{sum(n for size, n in sizes.items() if size > 1)} clusters of 2 or more"]
+        lines += [f"  {size:5d}  {url}" for url, size in self.largest_clusters(limit)]
+        return "\n".join(lines)
+
+    def flush(self):
+        """Write buffered additions to disk"""
+        with self.lock:
+            for f in (self.signature_file, self.cluster_file, self.url_file):
+                f.flush()
+
+    def close(self):
+        """Flush and close the index files"""
+        with self.lock:
+            for f in (self.signature_file, self.cluster_file, self.url_file):
+                f.close()
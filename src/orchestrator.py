@@ -0,0 +1,225 @@
+"""
+Module for running the scraping stages of all sites as one streaming pipeline.
+"""
+
+import csv
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from wayback_scraper import WaybackMachineScraper
+from url_extractor import URLExtractor, SNAPSHOT_STAGE
+from article_fetcher import ArticleFetcher, ArticleOutputs, ARTICLE_STAGE
+from metrics import QUEUE_DEPTH
+from status_ledger import PENDING, DONE, FAILED
+
+logger = logging.getLogger(__name__)
+
+
+class TaskTracker:
+    """Counts a site's queued and running tasks so the pipeline knows when it has drained"""
+
+    def __init__(self):
+        self.pending = 0
+        self.condition = threading.Condition()
+
+    def start(self):
+        with self.condition:
+            self.pending += 1
+
+    def finish(self):
+        with self.condition:
+            self.pending -= 1
+            if self.pending == 0:
+                self.condition.notify_all()
+
+    def wait_idle(self):
+        """Block until every started task has finished"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending == 0)
+
+
+class SitePipeline:
+    """State shared by the stages of one site while the pipeline runs"""
+
+    def __init__(self, config, site_name, seen_urls, parquet=False, near_duplicates=None, duplicate_index=None):
+        """Open the site's outputs and locate its data files"""
+        self.site_name = site_name
+        self.base_url = config.sites[site_name]['base_url']
+        self.wayback_file = config.get_site_data_path(site_name, "urls_wayback.csv")
+        self.uncleaned_file = config.get_site_data_path(site_name, "urls_uncleaned.csv")
+        self.cleaned_file = config.get_site_data_path(site_name, "urls_cleaned.csv")
+
+        self.outputs = ArticleOutputs(config, site_name, parquet=parquet, seen_urls=seen_urls,
+                                      near_duplicates=near_duplicates, duplicate_index=duplicate_index)
+        self.ledger = self.outputs.ledger
+        self.seen_urls = self.outputs.seen_urls
+        # Serializes appends to the site's CSV files
+        self.write_lock = threading.Lock()
+        self.tracker = TaskTracker()
+
+
+class PipelineOrchestrator:
+    """Streams work through snapshot discovery, link extraction and article fetching
+
+    Each discovered snapshot is handed to link extraction straight away, and
+    each new article URL on it to article fetching, instead of every stage
+    waiting for the previous one to finish. All sites run in parallel and
+    share one worker pool per stage, which caps that stage's concurrency.
+    Queued work per stage is bounded by ``max_pending`` so discovery cannot
+    run arbitrarily far ahead of fetching. With ``incremental`` set, discovery
+    only queries dates that earlier runs have not covered. ``near_duplicates``
+    ('tag' or 'skip') checks every fetched article against one near-duplicate
+    index shared by all sites. Failed snapshots are retried on later runs,
+    up to the extractor's ``max_attempts``.
+    """
+
+    def __init__(self, config, snapshot_workers=8, article_workers=16, max_pending=256, parquet=False,
+                 incremental=False, near_duplicates=None):
+        """Initialize the stages and their worker pools"""
+        self.config = config
+        self.parquet = parquet
+        self.near_duplicates = near_duplicates
+        self.scraper = WaybackMachineScraper(config, incremental=incremental)
+        self.extractor = URLExtractor(config, concurrency=snapshot_workers)
+        self.fetcher = ArticleFetcher(config)
+        # One keep-alive connection per article worker
+        config.get_http_client(pool_size=article_workers)
+
+        # One seen-URL index for all sites, so its Bloom filter sees every addition
+        self.seen_urls = config.open_seen_index()
+        self.duplicate_index = config.open_near_duplicate_index() if near_duplicates else None
+
+        self.snapshot_pool = ThreadPoolExecutor(max_workers=snapshot_workers, thread_name_prefix="snapshot")
+        self.article_pool = ThreadPoolExecutor(max_workers=article_workers, thread_name_prefix="article")
+        self.snapshot_slots = threading.BoundedSemaphore(max_pending)
+        self.article_slots = threading.BoundedSemaphore(max_pending)
+
+    def run(self, sites=None):
+        """Run the pipeline for the given sites, or all configured sites"""
+        sites = list(sites or self.config.target_sites)
+        threads = [threading.Thread(target=self.run_site, args=(site_name,), name=f"site-{site_name}")
+                   for site_name in sites]
+
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.snapshot_pool.shutdown()
+            self.article_pool.shutdown()
+            self.seen_urls.close()
+            if self.duplicate_index is not None:
+                logger.info(f"Near-duplicate articles: {self.duplicate_index.report()}")
+                self.duplicate_index.close()
+
+    def run_site(self, site_name):
+        """Discover, extract and fetch everything for one site"""
+        logger.info(f"Starting pipeline for {site_name}")
+        site = SitePipeline(self.config, site_name, self.seen_urls, parquet=self.parquet,
+                            near_duplicates=self.near_duplicates, duplicate_index=self.duplicate_index)
+        ledger = site.ledger
+
+        try:
+            # Seed rows from the CSV files and resume work left by earlier runs
+            ledger.add_csv(SNAPSHOT_STAGE, site.wayback_file, header=True)
+            ledger.add_csv(ARTICLE_STAGE, site.cleaned_file, header=False)
+            ledger.release_claims(SNAPSHOT_STAGE)
+            ledger.release_claims(ARTICLE_STAGE)
+            ledger.requeue(SNAPSHOT_STAGE, FAILED, max_attempts=self.extractor.max_attempts)
+
+            for site_id, url in site.outputs.skip_fetched(ledger.iter_claims(ARTICLE_STAGE)):
+                self._submit_article(site, site_id, url)
+            for snapshot_id, snapshot_url in ledger.iter_claims(SNAPSHOT_STAGE):
+                self._submit_snapshot(site, snapshot_id, snapshot_url)
+
+            self._discover(site)
+            site.tracker.wait_idle()
+
+            # Mirror the statuses back into the CSV files
+            site.outputs.save_progress(finish=True)
+            ledger.export_csv(SNAPSHOT_STAGE, site.wayback_file, header=['timestamp', 'url', 'status'])
+            ledger.export_csv(ARTICLE_STAGE, site.cleaned_file)
+
+            logger.info(f"Completed pipeline for {site_name}: snapshots {ledger.counts(SNAPSHOT_STAGE)}, "
+                        f"articles {ledger.counts(ARTICLE_STAGE)}")
+
+        except Exception as e:
+            logger.error(f"Error running pipeline for {site_name}: {e}")
+            site.tracker.wait_idle()
+
+        finally:
+            site.outputs.close()
+
+    def _discover(self, site):
+        """Stream snapshots from the CDX index into the extraction stage"""
+        is_new_file = not site.wayback_file.exists()
+        with open(site.wayback_file, 'a', newline='') as file:
+            writer = csv.writer(file)
+            if is_new_file:
+                writer.writerow(['timestamp', 'url', 'status'])
+
+            for snapshot_timestamp, snapshot_url in self.scraper.iter_snapshots(site.site_name):
+                snapshot_id = int(snapshot_timestamp)
+                # Snapshots already in the ledger were handled or resumed above
+                if not site.ledger.add(SNAPSHOT_STAGE, [(snapshot_id, snapshot_url, PENDING)]):
+                    continue
+
+                with site.write_lock:
+                    writer.writerow([snapshot_timestamp, snapshot_url, PENDING])
+                self._submit_snapshot(site, snapshot_id, snapshot_url)
+
+    def _submit_snapshot(self, site, snapshot_id, snapshot_url):
+        self.snapshot_slots.acquire()
+        site.tracker.start()
+        QUEUE_DEPTH.inc(stage=SNAPSHOT_STAGE)
+        self.snapshot_pool.submit(self._process_snapshot, site, snapshot_id, snapshot_url)
+
+    def _submit_article(self, site, site_id, url):
+        self.article_slots.acquire()
+        site.tracker.start()
+        QUEUE_DEPTH.inc(stage=ARTICLE_STAGE)
+        self.article_pool.submit(self._process_article, site, site_id, url)
+
+    def _process_snapshot(self, site, snapshot_id, snapshot_url):
+        """Extract a snapshot's article URLs and pass the new ones to the fetching stage"""
+        try:
+            article_urls = self.extractor.process_snapshot(snapshot_url, snapshot_id, site.base_url, site.site_name)
+            if article_urls is None:
+                site.ledger.fail(SNAPSHOT_STAGE, snapshot_url, "fetch failed")
+                return
+
+            # The new URLs are queued in the ledger before they count as seen
+            with site.write_lock:
+                new_urls = self.extractor.save_links(
+                    article_urls, site.uncleaned_file, snapshot_id, site.seen_urls,
+                    queue=lambda urls: site.ledger.add(ARTICLE_STAGE, [(snapshot_id, url, PENDING) for url in urls]))
+            site.ledger.complete(SNAPSHOT_STAGE, snapshot_url, DONE)
+
+            for site_id, url in site.outputs.skip_fetched((snapshot_id, url) for url in new_urls):
+                self._submit_article(site, site_id, url)
+
+        except Exception as e:
+            logger.error(f"Error processing snapshot {snapshot_url}: {e}")
+            site.ledger.fail(SNAPSHOT_STAGE, snapshot_url, e)
+
+        finally:
+            QUEUE_DEPTH.dec(stage=SNAPSHOT_STAGE)
+            self.snapshot_slots.release()
+            site.tracker.finish()
+
+    def _process_article(self, site, site_id, url):
+        """Fetch one article and record the result"""
+        try:
+            try:
+                article_dict = self.fetcher.fetch_article(url, site_id)
+            except Exception as e:
+                site.outputs.record(url, site_id, None, e)
+            else:
+                site.outputs.record(url, site_id, article_dict)
+
+        finally:
+            QUEUE_DEPTH.dec(stage=ARTICLE_STAGE)
+            self.article_slots.release()
+            site.tracker.finish()
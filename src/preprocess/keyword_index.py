@@ -0,0 +1,416 @@
+"""
+Module for tokenizing cleaned articles and indexing their keywords by month.
+"""
+
+import os
+import re
+import json
+import logging
+from pathlib import Path
+from collections import deque
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from preprocess.non_related_words import NON_RELATED_WORDS
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+SEGMENT_PREFIX = "segment-"
+DEFAULT_FIELDS = ("title", "maintext")
+
+# Months are counted from January 1970; articles without a capture time get UNKNOWN_MONTH
+UNKNOWN_MONTH = np.iinfo(np.uint16).max
+
+TOKEN = re.compile(r"[a-z0-9]+(?:['.][a-z0-9]+)*")
+MIN_TOKEN_LENGTH = 2
+
+
+def tokenize(text):
+    """Split text into lower-case word tokens, keeping inner apostrophes and dots (e.g. "u.s", "it's")"""
+    if not text:
+        return []
+    return TOKEN.findall(text.lower().replace('’', "'"))
+
+
+# Stopwords in token form, so entries like "(video)" or "u.s." match what tokenize produces
+STOPWORDS = frozenset(token for word in NON_RELATED_WORDS for token in tokenize(word))
+
+
+def keywords(text, stopwords=STOPWORDS):
+    """Get the tokens of a text that are long enough and not stopwords"""
+    return [token for token in tokenize(text) if len(token) >= MIN_TOKEN_LENGTH and token not in stopwords]
+
+
+def month_number(wayback_time):
+    """Get the capture month of a record's ``wayback_time`` (epoch milliseconds) as months since 1970"""
+    if wayback_time is None:
+        return UNKNOWN_MONTH
+    day = datetime.fromtimestamp(wayback_time / 1000, tz=timezone.utc)
+    return (day.year - 1970) * 12 + day.month - 1
+
+
+def parse_month(value):
+    """Get the month number of a 'YYYY-MM' string, a (year, month) pair or a date"""
+    if isinstance(value, str):
+        year, month = value.split('-')[:2]
+    elif isinstance(value, tuple):
+        year, month = value
+    else:
+        year, month = value.year, value.month
+    return (int(year) - 1970) * 12 + int(month) - 1
+
+
+def format_month(number):
+    """Get the 'YYYY-MM' string of a month number"""
+    return f"{1970 + number // 12:04d}-{number % 12 + 1:02d}"
+
+
+def _tokenize_batch(lines, fields):
+    """Tokenize a batch of JSON lines in a pool process
+
+    Returns the capture month of each line and, per field, the batch's
+    vocabulary plus parallel arrays of (line index, vocabulary index) pairs,
+    one pair per distinct keyword of a line. Lines that are not valid JSON
+    are indexed without keywords so line numbers stay aligned.
+    """
+    months = np.full(len(lines), UNKNOWN_MONTH, dtype=np.uint16)
+    postings = {field: ({}, [], []) for field in fields}
+
+    for line_index, line in enumerate(lines):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        months[line_index] = month_number(record.get("wayback_time"))
+
+        for field in fields:
+            vocabulary, doc_indexes, term_indexes = postings[field]
+            for term in set(keywords(record.get(field))):
+                doc_indexes.append(line_index)
+                term_indexes.append(vocabulary.setdefault(term, len(vocabulary)))
+
+    return months, {
+        field: (list(vocabulary), np.array(doc_indexes, dtype=np.uint32), np.array(term_indexes, dtype=np.uint32))
+        for field, (vocabulary, doc_indexes, term_indexes) in postings.items()
+    }
+
+
+class FieldSegment:
+    """Postings and monthly counts of one field in one index segment, as sorted arrays
+
+    ``terms`` holds the segment's term ids in ascending order, and the
+    documents of ``terms[i]`` are ``docs[starts[i]:starts[i + 1]]``, sorted.
+    ``count_terms``, ``count_months`` and ``counts`` list how many documents
+    contain each term per month, sorted by term and then month.
+    """
+
+    def __init__(self, terms, starts, docs, count_terms, count_months, counts):
+        self.terms = terms
+        self.starts = starts
+        self.docs = docs
+        self.count_terms = count_terms
+        self.count_months = count_months
+        self.counts = counts
+
+    @classmethod
+    def build(cls, doc_ids, term_ids, base, doc_months):
+        """Build a segment from (document id, term id) pairs and the months of its documents, numbered from ``base``"""
+        order = np.lexsort((doc_ids, term_ids))
+        doc_ids, term_ids = doc_ids[order], term_ids[order]
+        terms, first = np.unique(term_ids, return_index=True)
+        starts = np.append(first, len(term_ids)).astype(np.uint64)
+
+        keys = term_ids.astype(np.uint64) << np.uint64(16) | doc_months[doc_ids - base].astype(np.uint64)
+        keys, counts = np.unique(keys, return_counts=True)
+        return cls(terms, starts, doc_ids, (keys >> np.uint64(16)).astype(np.uint32),
+                   (keys & np.uint64(0xFFFF)).astype(np.uint16), counts.astype(np.uint32))
+
+    def arrays(self, field):
+        return {f"{field}_{name}": getattr(self, name)
+                for name in ("terms", "starts", "docs", "count_terms", "count_months", "counts")}
+
+    @classmethod
+    def from_arrays(cls, arrays, field):
+        return cls(*(arrays[f"{field}_{name}"]
+                     for name in ("terms", "starts", "docs", "count_terms", "count_months", "counts")))
+
+    def postings(self, term_id):
+        """Get the sorted document ids containing a term"""
+        position = np.searchsorted(self.terms, term_id)
+        if position == len(self.terms) or self.terms[position] != term_id:
+            return self.docs[:0]
+        return self.docs[self.starts[position]:self.starts[position + 1]]
+
+    def monthly(self, term_id):
+        """Get the (months, counts) arrays of a term"""
+        start, end = np.searchsorted(self.count_terms, [term_id, term_id + 1])
+        return self.count_months[start:end], self.counts[start:end]
+
+
+class KeywordIndex:
+    """Incremental inverted index of the keywords of an articles_cleaned.jsonl file
+
+    Each article is a document numbered in file order and located by the
+    byte offset of its line, so matching records are read with one seek
+    each. Every ``update`` tokenizes only the lines appended since the last
+    one, in a pool of processes, and writes them as a new segment of numpy
+    arrays: per field, the postings (term -> sorted document ids) and the
+    number of documents per term and capture month. Term ids come from one
+    append-only vocabulary per field, shared by all segments. Queries read
+    only these arrays, never the article text.
+    """
+
+    def __init__(self, directory, source=None, fields=DEFAULT_FIELDS):
+        """Open the index in the given directory, creating it for the ``source`` JSONL file if needed"""
+        self.directory = Path(directory)
+        manifest_path = self.directory / MANIFEST_FILE
+
+        if manifest_path.exists():
+            with open(manifest_path, 'r') as f:
+                self.manifest = json.load(f)
+        else:
+            if source is None:
+                raise FileNotFoundError(f"No keyword index in {self.directory}")
+            self.manifest = {"source": str(source), "fields": list(fields), "indexed_bytes": 0,
+                             "documents": 0, "segments": []}
+
+        self.source = Path(self.manifest["source"])
+        self.fields = tuple(self.manifest["fields"])
+        self._load()
+
+    def _load(self):
+        """Load the vocabularies and segments listed in the manifest"""
+        self.vocabularies = {field: {} for field in self.fields}
+        for field, vocabulary in self.vocabularies.items():
+            path = self.directory / f"vocabulary-{field}.txt"
+            if path.exists():
+                with open(path, 'r', encoding='utf-8') as f:
+                    for term in f:
+                        vocabulary[term.rstrip('\n')] = len(vocabulary)
+
+        offsets, months = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.uint16)]
+        self.segments = {field: [] for field in self.fields}
+        for name in self.manifest["segments"]:
+            with np.load(self.directory / name) as arrays:
+                offsets.append(arrays["doc_offsets"])
+                months.append(arrays["doc_months"])
+                for field in self.fields:
+                    self.segments[field].append(FieldSegment.from_arrays(arrays, field))
+        self.doc_offsets = np.concatenate(offsets)
+        self.doc_months = np.concatenate(months)
+
+    def __len__(self):
+        return len(self.doc_offsets)
+
+    def update(self, workers=None, batch_size=1000, segment_docs=200_000):
+        """Index the lines appended to the source since the last update, returning how many were added
+
+        Lines are tokenized ``batch_size`` at a time on ``workers`` processes
+        (default: one per CPU), and a segment is written every
+        ``segment_docs`` documents. If the source shrank, it was rewritten,
+        and the index is rebuilt from the start.
+        """
+        if not self.source.exists():
+            logger.warning(f"No articles to index at {self.source}")
+            return 0
+        if self.source.stat().st_size < self.manifest["indexed_bytes"]:
+            logger.warning(f"{self.source} is smaller than when it was indexed, rebuilding the index")
+            self.clear()
+
+        added = 0
+        pending = []
+        workers = workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for batch in self._tokenize(pool, batch_size, max_in_flight=workers * 2):
+                pending.append(batch)
+                if sum(len(offsets) for offsets, _, _ in pending) >= segment_docs:
+                    added += self._write_segment(pending)
+                    pending = []
+            added += self._write_segment(pending)
+
+        logger.info(f"Indexed {added} new articles from {self.source} ({len(self)} in total)")
+        return added
+
+    def _tokenize(self, pool, batch_size, max_in_flight):
+        """Yield (line offsets, end offset, tokenized batch) in file order, keeping a bounded number of batches in flight"""
+        in_flight = deque()
+        for offsets, end, lines in self._read_batches(batch_size):
+            in_flight.append((offsets, end, pool.submit(_tokenize_batch, lines, self.fields)))
+            if len(in_flight) >= max_in_flight:
+                offsets, end, future = in_flight.popleft()
+                yield offsets, end, future.result()
+
+        while in_flight:
+            offsets, end, future = in_flight.popleft()
+            yield offsets, end, future.result()
+
+    def _read_batches(self, batch_size):
+        """Yield (line offsets, end offset, lines) batches of the complete lines past the indexed part of the source"""
+        offset = self.manifest["indexed_bytes"]
+        with open(self.source, 'rb') as f:
+            f.seek(offset)
+            offsets, lines = [], []
+            for line in f:
+                # A line still being written is left for the next update
+                if not line.endswith(b'\n'):
+                    break
+                offsets.append(offset)
+                lines.append(line)
+                offset += len(line)
+                if len(lines) >= batch_size:
+                    yield offsets, offset, lines
+                    offsets, lines = [], []
+            if lines:
+                yield offsets, offset, lines
+
+    def _write_segment(self, batches):
+        """Merge tokenized batches into a new segment and record it in the manifest"""
+        if not batches:
+            return 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        base = len(self)
+        doc_offsets = np.array([offset for offsets, _, _ in batches for offset in offsets], dtype=np.int64)
+        doc_months = np.concatenate([months for _, _, (months, _) in batches])
+        arrays = {"doc_offsets": doc_offsets, "doc_months": doc_months}
+
+        for field in self.fields:
+            vocabulary = self.vocabularies[field]
+            new_terms = []
+            doc_ids, term_ids = [], []
+            batch_base = base
+            for offsets, _, (_, postings) in batches:
+                batch_terms, doc_indexes, term_indexes = postings[field]
+                # Map the batch's own term numbering onto the field's vocabulary
+                mapping = np.empty(len(batch_terms), dtype=np.uint32)
+                for index, term in enumerate(batch_terms):
+                    term_id = vocabulary.get(term)
+                    if term_id is None:
+                        term_id = vocabulary[term] = len(vocabulary)
+                        new_terms.append(term)
+                    mapping[index] = term_id
+                doc_ids.append(doc_indexes + np.uint32(batch_base))
+                term_ids.append(mapping[term_indexes])
+                batch_base += len(offsets)
+
+            segment = FieldSegment.build(np.concatenate(doc_ids), np.concatenate(term_ids), base, doc_months)
+            arrays.update(segment.arrays(field))
+            self.segments[field].append(segment)
+            with open(self.directory / f"vocabulary-{field}.txt", 'a', encoding='utf-8') as f:
+                f.writelines(f"{term}\n" for term in new_terms)
+
+        name = f"{SEGMENT_PREFIX}{len(self.manifest['segments']) + 1:06d}.npz"
+        np.savez(self.directory / name, **arrays)
+
+        self.doc_offsets = np.concatenate([self.doc_offsets, doc_offsets])
+        self.doc_months = np.concatenate([self.doc_months, doc_months])
+        self.manifest["segments"].append(name)
+        self.manifest["documents"] = len(self)
+        self.manifest["indexed_bytes"] = batches[-1][1]
+        self._save_manifest()
+        return len(doc_offsets)
+
+    def _save_manifest(self):
+        """Write the manifest, replacing it atomically, which commits the segments it lists"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.directory / (MANIFEST_FILE + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        tmp_path.replace(self.directory / MANIFEST_FILE)
+
+    def clear(self):
+        """Drop all indexed documents"""
+        for name in self.manifest["segments"]:
+            (self.directory / name).unlink(missing_ok=True)
+        for field in self.fields:
+            (self.directory / f"vocabulary-{field}.txt").unlink(missing_ok=True)
+        self.manifest.update(indexed_bytes=0, documents=0, segments=[])
+        self._save_manifest()
+        self._load()
+
+    def _field(self, field):
+        field = field or self.fields[0]
+        if field not in self.vocabularies:
+            raise ValueError(f"Field {field} is not indexed (indexed: {', '.join(self.fields)})")
+        return field
+
+    def postings(self, term, field=None):
+        """Get the sorted ids of the documents whose field contains a term"""
+        field = self._field(field)
+        term_id = self.vocabularies[field].get(term.lower())
+        if term_id is None:
+            return np.zeros(0, dtype=np.uint32)
+        return np.concatenate([segment.postings(term_id) for segment in self.segments[field]] or
+                              [np.zeros(0, dtype=np.uint32)])
+
+    def search(self, terms, field=None, start=None, end=None, match="all"):
+        """Get the ids of documents containing all (or, with ``match='any'``, any) of the terms
+
+        ``start`` and ``end`` limit the results to an inclusive range of
+        capture months, given as 'YYYY-MM' strings, (year, month) pairs or dates.
+        """
+        if isinstance(terms, str):
+            terms = [terms]
+        lists = [self.postings(term, field) for term in terms]
+        if not lists:
+            return np.zeros(0, dtype=np.uint32)
+
+        docs = lists[0]
+        for other in lists[1:]:
+            docs = np.intersect1d(docs, other, assume_unique=True) if match == "all" else np.union1d(docs, other)
+        return docs[self._in_months(self.doc_months[docs], start, end)]
+
+    @staticmethod
+    def _in_months(months, start, end):
+        keep = months != UNKNOWN_MONTH if start is not None or end is not None else np.ones(len(months), dtype=bool)
+        if start is not None:
+            keep &= months >= parse_month(start)
+        if end is not None:
+            keep &= months <= parse_month(end)
+        return keep
+
+    def monthly_counts(self, term, field=None, start=None, end=None):
+        """Get the number of documents containing a term per capture month, as {'YYYY-MM': count}"""
+        field = self._field(field)
+        term_id = self.vocabularies[field].get(term.lower())
+        counts = {}
+        if term_id is None:
+            return counts
+
+        for segment in self.segments[field]:
+            months, month_counts = segment.monthly(term_id)
+            keep = self._in_months(months, start, end) & (months != UNKNOWN_MONTH)
+            for month, count in zip(months[keep].tolist(), month_counts[keep].tolist()):
+                counts[format_month(month)] = counts.get(format_month(month), 0) + count
+        return dict(sorted(counts.items()))
+
+    def top_terms(self, field=None, start=None, end=None, limit=20):
+        """Get the (term, document count) pairs of the most frequent terms in a range of months"""
+        field = self._field(field)
+        totals = np.zeros(len(self.vocabularies[field]), dtype=np.int64)
+        for segment in self.segments[field]:
+            keep = self._in_months(segment.count_months, start, end)
+            totals += np.bincount(segment.count_terms[keep], weights=segment.counts[keep],
+                                  minlength=len(totals)).astype(np.int64)
+
+        terms = list(self.vocabularies[field])
+        best = np.argsort(totals, kind='stable')[::-1][:limit]
+        return [(terms[term_id], int(totals[term_id])) for term_id in best if totals[term_id]]
+
+    def articles(self, doc_ids):
+        """Yield the cleaned records of documents, read from the source by offset"""
+        with open(self.source, 'rb') as f:
+            for doc_id in doc_ids:
+                f.seek(int(self.doc_offsets[doc_id]))
+                yield json.loads(f.readline())
+
+
+def build_site_index(config, site_name, workers=None):
+    """Create or update the keyword index of a site's cleaned articles"""
+    index = KeywordIndex(config.get_site_data_path(site_name, "keyword_index"),
+                         source=config.get_site_data_path(site_name, "articles_cleaned.jsonl"))
+    index.update(workers=workers)
+    return index
@@ -0,0 +1,320 @@
+"""
+Module for pacing and retrying HTTP requests against rate-limited hosts.
+"""
+
+import threading
+import time
+import random
+import logging
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+from metrics import HTTP_LATENCY, HTTP_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying after a backoff
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Status codes telling the client to slow down
+THROTTLE_STATUS_CODES = {429, 503}
+
+# Longest Retry-After pause honored, so a bogus header cannot stall a worker
+MAX_RETRY_AFTER = 600
+
+
+class TokenBucket:
+    """Thread-safe token bucket that refills at a fixed rate"""
+
+    def __init__(self, rate, capacity=None):
+        """Initialize with a refill rate in tokens per second"""
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def acquire(self, tokens=1):
+        """Block until the requested number of tokens is available"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self._refill()
+                    if self.tokens >= tokens:
+                        self.tokens -= tokens
+                        return
+                    wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def set_rate(self, rate):
+        """Change the refill rate, keeping the tokens earned at the old rate"""
+        with self.lock:
+            self._refill()
+            self.rate = float(rate)
+
+    def pause(self, seconds):
+        """Hand out no tokens for the given number of seconds"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+            self.updated = self.paused_until
+
+
+class RateLimiter:
+    """Keeps one token bucket per key, e.g. per host and per proxy"""
+
+    def __init__(self, rate, burst=None):
+        """Initialize with the per-key rate in requests per second"""
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, key):
+        """Get the token bucket for a key, creating it on first use"""
+        with self.lock:
+            if key not in self.buckets:
+                self.buckets[key] = TokenBucket(self.rate, self.burst)
+            return self.buckets[key]
+
+    def acquire(self, *keys):
+        """Take one token from the bucket of every given key"""
+        for key in keys:
+            if key:
+                self.bucket(key).acquire()
+
+    def observe(self, keys, status, latency, retry_after=None):
+        """Learn from the outcome of a request; a fixed-rate limiter only honors Retry-After"""
+        if retry_after:
+            for key in keys:
+                if key:
+                    self.bucket(key).pause(retry_after)
+
+
+class CircuitBreaker:
+    """Holds back requests to a key after repeated failures or throttling, then lets one probe through
+
+    After ``failure_threshold`` failures in a row the circuit opens and
+    requests wait for ``reset_timeout`` seconds. A single probe is then let
+    through: success closes the circuit, failure opens it again for twice as
+    long, up to ``max_reset_timeout``. Waiting instead of failing fast keeps
+    queued work from being marked failed during a short outage.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, max_reset_timeout=600.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.open_seconds = reset_timeout
+        self.opened_at = 0.0
+        self.probe_started = None
+        self.lock = threading.Lock()
+
+    def admit(self):
+        """Get 0 if a request may go ahead now, or the seconds to wait before asking again"""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return 0
+
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                reopen = self.opened_at + self.open_seconds
+                if now < reopen:
+                    return reopen - now
+                self.state = self.HALF_OPEN
+                self.probe_started = None
+
+            # One probe at a time; a probe that never reported back is replaced
+            if self.probe_started is None or now - self.probe_started > self.reset_timeout:
+                self.probe_started = now
+                return 0
+            return min(1.0, self.reset_timeout)
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                logger.info("Circuit closed after a successful probe")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.open_seconds = self.reset_timeout
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                self.open_seconds = min(self.max_reset_timeout, self.open_seconds * 2)
+            elif self.state == self.OPEN or self.failures < self.failure_threshold:
+                return
+
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            logger.warning(f"Circuit opened for {self.open_seconds:.0f}s after {self.failures} failures")
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """Rate limiter that tunes each key's rate from the outcomes of its requests
+
+    Rates follow additive-increase/multiplicative-decrease: every healthy
+    response raises a key's rate by about ``increase`` requests per second
+    per second of traffic, while a throttling status, a server error, a
+    connection failure or a latency above ``target_latency`` multiplies it
+    by ``decrease``, at most once per cool-down so a burst of failures only
+    counts once. Rates stay between ``min_rate`` and ``max_rate``.
+    ``Retry-After`` pauses the key's bucket, and each key has a circuit
+    breaker against sustained failures or throttling.
+    """
+
+    def __init__(self, rate, burst=None, min_rate=0.2, max_rate=None, increase=1.0, decrease=0.5,
+                 target_latency=10.0, failure_threshold=5, reset_timeout=30.0):
+        """Initialize with the starting per-key rate in requests per second"""
+        super().__init__(rate, burst)
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate * 4
+        self.increase = increase
+        self.decrease = decrease
+        self.target_latency = target_latency
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        self.last_decrease = {}
+
+    def breaker(self, key):
+        """Get the circuit breaker for a key, creating it on first use"""
+        with self.lock:
+            if key not in self.breakers:
+                self.breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self.breakers[key]
+
+    def acquire(self, *keys):
+        """Wait until every key's circuit admits a request, then take their tokens"""
+        for key in keys:
+            if key:
+                while True:
+                    wait = self.breaker(key).admit()
+                    if not wait:
+                        break
+                    time.sleep(wait)
+        super().acquire(*keys)
+
+    def observe(self, keys, status, latency, retry_after=None):
+        """Adjust the keys' rates and circuits after a request; ``status`` is None on a connection error"""
+        super().observe(keys, status, latency, retry_after)
+
+        # Throttling counts against the circuit too, so a host that only answers 429 opens it
+        failed = status is None or status >= 500 or status in THROTTLE_STATUS_CODES
+        overloaded = failed or latency > self.target_latency
+
+        for key in keys:
+            if not key:
+                continue
+
+            breaker = self.breaker(key)
+            if failed:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+
+            bucket = self.bucket(key)
+            if overloaded:
+                now = time.monotonic()
+                with self.lock:
+                    # Cool down for at least one request interval at the old rate
+                    if now - self.last_decrease.get(key, 0.0) < max(1.0, 1.0 / bucket.rate):
+                        continue
+                    self.last_decrease[key] = now
+                rate = max(self.min_rate, bucket.rate * self.decrease)
+                logger.debug(f"Rate for {key} lowered to {rate:.2f}/s (status {status}, {latency:.1f}s)")
+            else:
+                rate = min(self.max_rate, bucket.rate + self.increase / bucket.rate)
+            bucket.set_rate(rate)
+
+    def rates(self):
+        """Get the current rate in requests per second of every key"""
+        with self.lock:
+            buckets = dict(self.buckets)
+        return {key: bucket.rate for key, bucket in buckets.items()}
+
+    def circuits(self):
+        """Get the circuit state of every key"""
+        with self.lock:
+            breakers = dict(self.breakers)
+        return {key: breaker.state for key, breaker in breakers.items()}
+
+
+def parse_retry_after(value):
+    """Get the seconds to wait from a Retry-After header, given in seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def request_keys(url, proxy=None):
+    """Get the rate limiter keys for a request: its host and its proxy, without credentials"""
+    return urlparse(url).netloc, urlparse(proxy).hostname if proxy else None
+
+
+def request_with_retry(get, url, limiter=None, proxy=None, max_retries=3, backoff=1.0, **kwargs):
+    """Issue a GET through ``get``, retrying with backoff on 429 and 5xx responses
+
+    The limiter paces every attempt and is told each outcome, so an
+    adaptive limiter can tune its rates and honor ``Retry-After``.
+    """
+    keys = request_keys(url, proxy)
+
+    for attempt in range(max_retries + 1):
+        if limiter:
+            limiter.acquire(*keys)
+
+        retry_after = None
+        start = time.monotonic()
+        try:
+            response = get(url, **kwargs)
+        except Exception as e:
+            latency = time.monotonic() - start
+            HTTP_REQUESTS.inc(host=keys[0], status=0)
+            if limiter:
+                limiter.observe(keys, None, latency)
+            if attempt == max_retries:
+                raise
+            reason = str(e)
+        else:
+            latency = time.monotonic() - start
+            HTTP_REQUESTS.inc(host=keys[0], status=response.status_code)
+            HTTP_LATENCY.observe(latency, host=keys[0])
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if limiter:
+                limiter.observe(keys, response.status_code, latency, retry_after)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == max_retries:
+                return response
+            reason = f"Status {response.status_code}"
+            response.close()
+
+        # Exponential backoff with jitter so workers do not retry in lockstep,
+        # but never sooner than the server asked for
+        delay = max(retry_after or 0.0, backoff * (2 ** attempt) * (0.5 + random.random()))
+        logger.warning(f"Retrying {url} in {delay:.1f}s after {reason}")
+        time.sleep(delay)
@@ -0,0 +1,319 @@
+"""
+Module for writing cleaned article records.
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+from pathlib import Path
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# pyarrow is optional and slow to import, so the Parquet code loads it on first use
+pa = pq = None
+
+# Partition directory for records whose capture date is unknown
+DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# Field order of the records in articles_cleaned.jsonl
+CLEANED_FIELDS = ["title", "authors", "url", "date_publish", "description", "maintext", "wayback_time", "text_len"]
+
+
+def wayback_time_ms(wayback_id):
+    """Get the capture day of a Wayback timestamp as epoch milliseconds, or None if invalid"""
+    try:
+        day = datetime.strptime(str(wayback_id)[:8], '%Y%m%d').replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return int(day.timestamp()) * 1000
+
+
+def build_cleaned_record(article_data):
+    """Build a cleaned record from article fields, or None if it has no main text
+
+    ``wayback_time`` is the capture day in epoch milliseconds (UTC midnight) and
+    ``text_len`` the length of ``maintext``, as written by earlier versions.
+    Near-duplicate articles also carry ``duplicate_of``, the URL of the first
+    article of their cluster.
+    """
+    maintext = article_data.get("maintext")
+    if not maintext:
+        return None
+
+    record = {field: article_data.get(field) for field in CLEANED_FIELDS[:6]}
+    record["wayback_time"] = wayback_time_ms(article_data.get("wayback_id"))
+    record["text_len"] = len(maintext)
+    if article_data.get("duplicate_of"):
+        record["duplicate_of"] = article_data["duplicate_of"]
+    return record
+
+
+class JSONLRecordSink:
+    """Buffered writer of cleaned records to a JSON-lines file
+
+    Records are serialized as they arrive but only written in batches of
+    ``batch_size`` lines to a file that stays open. ``flush`` writes out the
+    pending batch, and with ``fsync`` enabled it also forces it to disk.
+    ``unfinished_urls`` names the records that would be lost in a crash.
+    """
+
+    def __init__(self, path, batch_size=100, fsync=True):
+        """Open the output file for appending"""
+        self.path = path
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.pending = []
+        self.pending_urls = set()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record):
+        """Queue a record, writing the batch out once it is full"""
+        self.pending.append(json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str))
+        self.pending_urls.add(record.get("url"))
+        if len(self.pending) >= self.batch_size:
+            self._write_pending()
+
+    def _write_pending(self):
+        if self.pending:
+            self.pending.append('')
+            self.file.write('\n'.join(self.pending))
+            self.pending = []
+
+    def flush(self, finish=False):
+        """Write out pending records and apply the fsync policy; a JSON-lines file is always readable"""
+        self._write_pending()
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.pending_urls = set()
+
+    def unfinished_urls(self):
+        """Get the URLs of records not flushed yet"""
+        return self.pending_urls
+
+    def close(self):
+        """Flush and close the output file"""
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _import_pyarrow():
+    """Import pyarrow once, raising ImportError if it is not installed"""
+    global pa, pq
+    if pq is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:  # pragma: no cover - pyarrow is optional
+            raise ImportError("pyarrow is required for Parquet output") from None
+        pa, pq = pyarrow, pyarrow.parquet
+
+
+def _parquet_schema():
+    """Get the Arrow schema of cleaned records; partition columns live in the path"""
+    return pa.schema([
+        ("title", pa.string()),
+        ("authors", pa.list_(pa.string())),
+        ("url", pa.string()),
+        ("date_publish", pa.string()),
+        ("description", pa.string()),
+        ("maintext", pa.string()),
+        ("wayback_time", pa.timestamp('ms', tz='UTC')),
+        ("text_len", pa.int64()),
+        ("duplicate_of", pa.string()),
+    ])
+
+
+def _partition_of(record):
+    """Get the (year, month) partition of a record from its capture time"""
+    if record.get("wayback_time") is None:
+        return DEFAULT_PARTITION, DEFAULT_PARTITION
+    day = datetime.fromtimestamp(record["wayback_time"] / 1000, tz=timezone.utc)
+    return f"{day.year:04d}", f"{day.month:02d}"
+
+
+class _PartFile:
+    """Parquet file being written under a hidden name, renamed into place once finished"""
+
+    def __init__(self, path, schema, **options):
+        self.path = path
+        self.tmp_path = path.with_name(f".{path.name}")
+        self.writer = pq.ParquetWriter(self.tmp_path, schema, **options)
+        self.opened = time.monotonic()
+        self.rows = 0
+        self.urls = set()
+
+    def write(self, table):
+        self.writer.write_table(table)
+        self.rows += len(table)
+        self.urls.update(table.column("url").to_pylist())
+
+    def finish(self, fsync=True):
+        """Write the footer, force the file to disk and give it its visible name"""
+        self.writer.close()
+        if fsync:
+            fd = os.open(self.tmp_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self.tmp_path.replace(self.path)
+
+
+class ParquetRecordSink:
+    """Columnar writer of cleaned records, partitioned by site and capture year/month
+
+    Files are laid out as ``site=<site>/year=<YYYY>/month=<MM>/part-*.parquet``
+    under ``root``. Each run writes new part files and never touches existing
+    ones, and a row group is appended to a partition's file whenever
+    ``batch_size`` records are pending for it. A part file is written under
+    a hidden name, which readers skip, and renamed once its footer is
+    written: when it holds ``rows_per_file`` rows, when ``flush`` finds it
+    older than ``max_file_seconds``, or when ``flush`` is asked to finish
+    every file. Until then its records are listed by ``unfinished_urls``, so
+    callers can hold back anything that depends on them being durable.
+    Columns are zstd-compressed, with a higher level for the bulky
+    ``maintext``, and repetitive columns are dictionary-encoded, so scans of
+    title, date or text_len do not read article bodies.
+    """
+
+    def __init__(self, root, site_name, batch_size=1000, compression_level=3, text_compression_level=9,
+                 fsync=True, rows_per_file=100_000, max_file_seconds=600):
+        """Prepare to write partitions for a site under the root directory"""
+        _import_pyarrow()
+
+        self.root = Path(root)
+        self.site_name = site_name
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.rows_per_file = rows_per_file
+        self.max_file_seconds = max_file_seconds
+        self.schema = _parquet_schema()
+        self.compression_level = {name: compression_level for name in self.schema.names}
+        self.compression_level["maintext"] = text_compression_level
+        self.run_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.parts = 0
+        self.pending = {}
+        self.files = {}
+
+    def write(self, record):
+        """Queue a record in its partition, writing a row group once enough are pending"""
+        partition = _partition_of(record)
+        rows = self.pending.setdefault(partition, [])
+        rows.append(record)
+        if len(rows) >= self.batch_size:
+            self._write_partition(partition)
+            if self.files[partition].rows >= self.rows_per_file:
+                self._finish(partition)
+
+    def _file(self, partition):
+        """Get the open part file of a partition, starting a new one if needed"""
+        part = self.files.get(partition)
+        if part is None:
+            year, month = partition
+            directory = self.root / f"site={self.site_name}" / f"year={year}" / f"month={month}"
+            directory.mkdir(parents=True, exist_ok=True)
+            self.parts += 1
+            part = self.files[partition] = _PartFile(
+                directory / f"part-{self.run_id}-{self.parts:05d}.parquet",
+                self.schema,
+                compression='zstd',
+                compression_level=self.compression_level,
+                use_dictionary=["authors", "date_publish", "description"],
+            )
+        return part
+
+    def _write_partition(self, partition):
+        rows = self.pending.pop(partition, None)
+        if rows:
+            self._file(partition).write(pa.Table.from_pylist(rows, schema=self.schema))
+
+    def _finish(self, partition):
+        """Write a partition's pending records and finish its part file"""
+        self._write_partition(partition)
+        part = self.files.pop(partition, None)
+        if part is not None:
+            part.finish(self.fsync)
+
+    def flush(self, finish=False):
+        """Finish the part files that are old enough, or all of them with ``finish`` set
+
+        Pending records of other partitions stay in memory, so row groups
+        keep their size.
+        """
+        now = time.monotonic()
+        for partition in set(self.pending) | set(self.files):
+            part = self.files.get(partition)
+            if finish or (part is not None and now - part.opened >= self.max_file_seconds):
+                self._finish(partition)
+
+    def unfinished_urls(self):
+        """Get the URLs of records not in a finished part file yet"""
+        urls = set()
+        for rows in self.pending.values():
+            urls.update(record.get("url") for record in rows)
+        for part in self.files.values():
+            urls.update(part.urls)
+        return urls
+
+    def close(self):
+        """Write the remaining records and finish all open part files"""
+        self.flush(finish=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _conform(table, schema):
+    """Cast a table to the schema, adding the columns it is missing as nulls"""
+    for field in schema:
+        if field.name not in table.column_names:
+            table = table.append_column(field, pa.nulls(len(table), field.type))
+    return table.select(schema.names).cast(schema)
+
+
+def compact_parquet_partitions(root, min_file_bytes=64 * 1024 * 1024):
+    """Merge the small part files of each partition under ``root`` into one file
+
+    Files at or above ``min_file_bytes`` are left alone. The merged file is
+    written before the small ones are removed, so an interruption can leave
+    duplicates but never lose records.
+    """
+    _import_pyarrow()
+
+    merged = 0
+    for directory in sorted({path.parent for path in Path(root).rglob("part-*.parquet")}):
+        small_files = sorted(path for path in directory.glob("part-*.parquet")
+                             if path.stat().st_size < min_file_bytes)
+        if len(small_files) < 2:
+            continue
+
+        # Small files are merged into a single table so row groups grow too; files
+        # written before a column was added get it as nulls
+        schema = _parquet_schema()
+        table = pa.concat_tables(_conform(pq.read_table(path), schema) for path in small_files)
+        target = directory / f"part-compacted-{uuid.uuid4().hex[:8]}.parquet"
+        # Hidden until complete, as dataset readers skip names starting with a dot
+        tmp_target = target.with_name(f".{target.name}")
+        pq.write_table(table, tmp_target, compression='zstd', compression_level={"maintext": 9},
+                       use_dictionary=["authors", "date_publish", "description"])
+        tmp_target.replace(target)
+
+        for path in small_files:
+            path.unlink()
+        merged += len(small_files)
+        logger.info(f"Compacted {len(small_files)} files in {directory}")
+
+    return merged
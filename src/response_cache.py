@@ -0,0 +1,144 @@
+"""
+Module for caching immutable HTTP response bodies on disk.
+"""
+
+import os
+import time
+import zlib
+import hashlib
+import sqlite3
+import threading
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    stored REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+CREATE TABLE IF NOT EXISTS objects (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS objects_accessed ON objects (accessed);
+"""
+
+
+def cache_key(url, timestamp=None):
+    """Get the cache key for a URL captured at an optional Wayback timestamp"""
+    return f"{timestamp}|{url}" if timestamp else url
+
+
+class ResponseCache:
+    """Content-addressed store of compressed response bodies with LRU eviction
+
+    Bodies are stored once per content hash under ``objects/``, and requests
+    (URL plus Wayback timestamp) map to a content hash. Archived captures
+    never change, so a hit can be replayed forever. When the compressed size
+    exceeds ``max_bytes`` the least recently read bodies are evicted.
+    """
+
+    def __init__(self, directory, max_bytes=20 * 1024 ** 3, level=6, timeout=30):
+        """Open the cache in the given directory, creating it if needed"""
+        self.directory = Path(directory)
+        self.objects_dir = self.directory / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.level = level
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(str(self.directory / "index.sqlite"), timeout=timeout,
+                                    check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def _object_path(self, digest):
+        return self.objects_dir / digest[:2] / f"{digest}.z"
+
+    def get(self, url, timestamp=None):
+        """Get the cached body for a request, or None on a miss"""
+        key = cache_key(url, timestamp)
+        with self.lock:
+            row = self.conn.execute("SELECT digest FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            digest = row[0]
+            self.conn.execute("UPDATE objects SET accessed = ? WHERE digest = ?", (time.time(), digest))
+
+        try:
+            return zlib.decompress(self._object_path(digest).read_bytes())
+        except (OSError, zlib.error):
+            # The body was evicted or damaged; forget the entry
+            with self.lock:
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+
+    def put(self, url, body, timestamp=None):
+        """Store a response body for a request"""
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._object_path(digest)
+        now = time.time()
+
+        with self.lock:
+            known = self.conn.execute("SELECT 1 FROM objects WHERE digest = ?", (digest,)).fetchone()
+
+        if not known:
+            data = zlib.compress(body, self.level)
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(data)
+            tmp_path.replace(path)
+
+        with self.lock:
+            if not known:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO objects (digest, size, accessed) VALUES (?, ?, ?)",
+                    (digest, len(data), now)
+                )
+                self.total_bytes += len(data) if cursor.rowcount else 0
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (key, digest, stored) VALUES (?, ?, ?)",
+                (cache_key(url, timestamp), digest, now)
+            )
+
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self, target_ratio=0.9):
+        """Delete least recently read bodies until the cache is under the target size"""
+        target = self.max_bytes * target_ratio
+        evicted = 0
+
+        with self.lock:
+            while self.total_bytes > target:
+                rows = self.conn.execute("SELECT digest, size FROM objects ORDER BY accessed LIMIT 1000").fetchall()
+                if not rows:
+                    break
+                for digest, size in rows:
+                    if self.total_bytes <= target:
+                        break
+                    self.conn.execute("DELETE FROM objects WHERE digest = ?", (digest,))
+                    self.conn.execute("DELETE FROM entries WHERE digest = ?", (digest,))
+                    self._object_path(digest).unlink(missing_ok=True)
+                    self.total_bytes -= size
+                    evicted += 1
+
+        logger.info(f"Evicted {evicted} cached responses, {self.total_bytes} bytes remain")
+
+    def close(self):
+        """Close the cache index"""
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,205 @@
+"""
+Module for remembering which canonical URLs have been seen across runs and sites.
+"""
+
+import os
+import math
+import hashlib
+import sqlite3
+import threading
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Namespaces for the two questions the pipeline asks of the index
+EXTRACTED = 'extracted'
+FETCHED = 'fetched'
+
+
+def url_hash(url):
+    """Get a stable 64-bit signed hash of a canonical URL"""
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over 64-bit hashes, persisted as a flat bit array
+
+    The file starts with the number of stored URLs the filter holds, so a
+    reader can tell whether it still covers the whole table.
+    """
+
+    HEADER = 8
+
+    def __init__(self, capacity, fp_rate, path=None):
+        """Size the filter for ``capacity`` items at the target false-positive rate"""
+        self.num_bits = max(8, int(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.path = Path(path) if path else None
+        self.loaded = False
+        self.count = 0
+
+        size = (self.num_bits + 7) // 8
+        if self.path and self.path.exists() and self.path.stat().st_size == self.HEADER + size:
+            data = self.path.read_bytes()
+            self.count = int.from_bytes(data[:self.HEADER], 'big')
+            self.bits = bytearray(data[self.HEADER:])
+            self.loaded = True
+        else:
+            self.bits = bytearray(size)
+
+    def _positions(self, value):
+        # Double hashing: derive k probe positions from the two 32-bit halves
+        h1 = value & 0xFFFFFFFF
+        h2 = (value >> 32) & 0xFFFFFFFF | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, value):
+        """Add a 64-bit hash to the filter"""
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def clear(self):
+        """Remove every hash from the filter"""
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
+
+    def save(self):
+        """Write the count and bit array to its file"""
+        if self.path:
+            # Per-process temporary name, so concurrent saves never mix their bytes
+            tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            tmp_path.write_bytes(self.count.to_bytes(self.HEADER, 'big') + self.bits)
+            tmp_path.replace(self.path)
+
+
+class SeenIndex:
+    """Persistent "seen URL" set with a Bloom filter in front of an exact on-disk set
+
+    Membership is first checked against an in-memory Bloom filter, so most
+    never-seen URLs are answered without touching disk. Possible hits are
+    confirmed against a SQLite table of URL hashes, which is the source of
+    truth. The filter is saved on close together with the number of URLs it
+    holds, and rebuilt from the table when that number no longer matches,
+    so a run never trusts a filter written by another process that missed
+    its additions. Memory is bounded by ``capacity`` and ``fp_rate``, not by
+    the number of URLs stored.
+
+    With ``shared`` set, other processes write to the same index at the same
+    time: additions are committed straight away so they do not hold the
+    write lock, and every lookup goes to the table, since a local filter
+    would miss the other processes' additions.
+    """
+
+    def __init__(self, directory, capacity=10_000_000, fp_rate=0.01, shared=False, timeout=30):
+        """Open the index in the given directory, shared by all sites"""
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.shared = shared
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(str(self.directory / "seen.sqlite"), timeout=timeout,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS seen (namespace TEXT NOT NULL, hash INTEGER NOT NULL, "
+            "PRIMARY KEY (namespace, hash)) WITHOUT ROWID"
+        )
+
+        self.filters = {}
+
+    def _filter(self, namespace):
+        """Get the Bloom filter for a namespace, loading or rebuilding it on first use"""
+        bloom = self.filters.get(namespace)
+        if bloom is None:
+            path = self.directory / f"{namespace}-{self.capacity}-{self.fp_rate}.bloom"
+            bloom = BloomFilter(self.capacity, self.fp_rate, path)
+
+            # The table only grows, so a filter holding as many URLs as the
+            # table holds all of them; anything else is rebuilt
+            stored = self.conn.execute("SELECT COUNT(*) FROM seen WHERE namespace = ?", (namespace,)).fetchone()[0]
+            if not bloom.loaded or bloom.count != stored:
+                bloom.clear()
+                for (value,) in self.conn.execute("SELECT hash FROM seen WHERE namespace = ?", (namespace,)):
+                    bloom.add(value)
+                    bloom.count += 1
+                if bloom.count:
+                    logger.info(f"Rebuilt {namespace} Bloom filter from {bloom.count} stored URLs")
+
+            self.filters[namespace] = bloom
+        return bloom
+
+    def _stored(self, namespace, value):
+        # A filter miss is only exact while no other process adds to the table
+        if not self.shared and value not in self._filter(namespace):
+            return False
+        return self.conn.execute(
+            "SELECT 1 FROM seen WHERE namespace = ? AND hash = ?", (namespace, value)
+        ).fetchone() is not None
+
+    def contains(self, namespace, url):
+        """Check whether a canonical URL has been seen in a namespace"""
+        value = url_hash(url)
+        with self.lock:
+            return self._stored(namespace, value)
+
+    def unseen(self, namespace, urls):
+        """Get the URLs of a batch not seen before, without recording them"""
+        new_urls = []
+        batch = set()
+        with self.lock:
+            for url in urls:
+                value = url_hash(url)
+                if value not in batch and not self._stored(namespace, value):
+                    batch.add(value)
+                    new_urls.append(url)
+        return new_urls
+
+    def add(self, namespace, url):
+        """Record a canonical URL, returning True if it had not been seen before"""
+        value = url_hash(url)
+        with self.lock:
+            if self._stored(namespace, value):
+                return False
+            # The insert itself decides, so other processes sharing the table stay exact
+            cursor = self.conn.execute("INSERT OR IGNORE INTO seen (namespace, hash) VALUES (?, ?)",
+                                       (namespace, value))
+            if self.shared:
+                self.conn.commit()
+            elif cursor.rowcount == 1:
+                bloom = self._filter(namespace)
+                bloom.add(value)
+                bloom.count += 1
+            return cursor.rowcount == 1
+
+    def add_new(self, namespace, urls):
+        """Record a batch of URLs, returning only those not seen before"""
+        new_urls = [url for url in urls if self.add(namespace, url)]
+        self.commit()
+        return new_urls
+
+    def commit(self):
+        """Commit pending additions to disk"""
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        """Commit, persist the Bloom filters and close the index"""
+        with self.lock:
+            self.conn.commit()
+            if not self.shared:
+                for bloom in self.filters.values():
+                    bloom.save()
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
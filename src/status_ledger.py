@@ -0,0 +1,292 @@
+"""
+Module for tracking per-URL job status in a transactional SQLite ledger.
+"""
+
+import csv
+import time
+import itertools
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+LEDGER_FILE = "ledger.sqlite"
+
+# Status values shared with the CSV files: 'no' is pending, 'claimed' is in
+# flight, 'yes', 'none' and 'fail' are the outcomes of an attempt, and 'dup'
+# marks a URL skipped because it was already handled elsewhere
+PENDING = 'no'
+CLAIMED = 'claimed'
+DONE = 'yes'
+EMPTY = 'none'
+FAILED = 'fail'
+DUPLICATE = 'dup'
+
+# Bytes before a recorded CSV offset that must still match for rows up to it to be skipped
+OFFSET_TAIL_BYTES = 256
+
+# CSV rows read and inserted per transaction when seeding the ledger
+SEED_CHUNK_ROWS = 10_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    stage TEXT NOT NULL,
+    url TEXT NOT NULL,
+    ref_id INTEGER,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_at REAL,
+    updated_at REAL,
+    error TEXT,
+    worker_id TEXT,
+    lease_until REAL,
+    PRIMARY KEY (stage, url)
+);
+CREATE INDEX IF NOT EXISTS jobs_stage_status ON jobs (stage, status);
+CREATE TABLE IF NOT EXISTS csv_offsets (
+    stage TEXT NOT NULL,
+    csv_file TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    tail BLOB NOT NULL,
+    PRIMARY KEY (stage, csv_file)
+);
+"""
+
+# Columns added after the first release, with their types, for older ledgers
+ADDED_COLUMNS = {
+    'worker_id': 'TEXT',
+    'lease_until': 'REAL',
+}
+
+# Indexes on added columns, created once the columns exist. Claims look up
+# expired leases through this one instead of scanning every claimed row
+ADDED_INDEXES = """
+CREATE INDEX IF NOT EXISTS jobs_stage_status_lease ON jobs (stage, status, lease_until);
+"""
+
+
+class StatusLedger:
+    """Durable work queue of URLs per pipeline stage
+
+    Rows move from 'no' to 'claimed' when a worker takes them and then to
+    'yes', 'none' or 'fail'. Every transition is its own transaction, so a
+    crash loses at most the rows that were in flight, and those are put back
+    in the queue by ``release_claims`` on the next run.
+
+    Several processes may share one ledger file. Claims made with a
+    ``worker_id`` and a ``lease`` expire unless the worker renews them, and
+    expired claims are handed to the next worker that asks for work.
+    """
+
+    def __init__(self, path, timeout=30):
+        """Open or create the ledger database at the given path"""
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), timeout=timeout, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        self.conn.executescript(ADDED_INDEXES)
+
+    def close(self):
+        """Close the database connection"""
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, stage, rows):
+        """Add (ref_id, url, status) rows in one transaction, keeping the state of URLs already in the ledger"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self.conn.executemany(
+                    "INSERT OR IGNORE INTO jobs (stage, url, ref_id, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    ((stage, url, ref_id, status, now) for ref_id, url, status in rows)
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            return cursor.rowcount
+
+    def add_csv(self, stage, csv_file, header, chunk_size=SEED_CHUNK_ROWS):
+        """Seed the ledger from a status CSV with id, url and status columns
+
+        Rows up to the end of the previous seeding or export are skipped, so
+        appended rows are read without re-reading the whole file. A file that
+        was rewritten since is read again from the start. Rows are streamed in
+        transactions of ``chunk_size``, so memory does not grow with the file.
+        """
+        if not csv_file.exists():
+            return 0
+
+        offset = self._seeded_offset(stage, csv_file)
+        with open(csv_file, 'r', newline='') as f:
+            if offset:
+                f.seek(offset)
+            reader = csv.reader(f)
+            if header and not offset:
+                next(reader, None)
+            rows = ((int(row[0]), row[1], row[2] or PENDING) for row in reader if len(row) >= 3)
+            added = 0
+            for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+                added += self.add(stage, chunk)
+            end = f.tell()
+
+        self._record_offset(stage, csv_file, end)
+        logger.info(f"Seeded {added} new {stage} rows from {csv_file}" + (f" past byte {offset}" if offset else ""))
+        return added
+
+    def _seeded_offset(self, stage, csv_file):
+        """Get the byte offset up to which the CSV was already seeded, or 0 if it changed since"""
+        with self.lock:
+            row = self.conn.execute("SELECT offset, tail FROM csv_offsets WHERE stage = ? AND csv_file = ?",
+                                    (stage, str(csv_file))).fetchone()
+        if row is None:
+            return 0
+
+        offset, tail = row
+        with open(csv_file, 'rb') as f:
+            f.seek(max(0, offset - len(tail)))
+            return offset if f.read(len(tail)) == tail else 0
+
+    def _record_offset(self, stage, csv_file, offset):
+        """Remember that the CSV's rows up to a byte offset are in the ledger"""
+        with open(csv_file, 'rb') as f:
+            f.seek(max(0, offset - OFFSET_TAIL_BYTES))
+            tail = f.read(offset - f.tell())
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO csv_offsets (stage, csv_file, offset, tail) VALUES (?, ?, ?, ?)",
+                              (stage, str(csv_file), offset, tail))
+
+    def release_claims(self, stage, worker_id=None):
+        """Put rows left claimed by an interrupted run, or by one worker, back in the queue"""
+        query = ("UPDATE jobs SET status = ?, claimed_at = NULL, worker_id = NULL, lease_until = NULL "
+                 "WHERE stage = ? AND status = ?")
+        params = [PENDING, stage, CLAIMED]
+        if worker_id is not None:
+            query += " AND worker_id = ?"
+            params.append(worker_id)
+
+        with self.lock:
+            cursor = self.conn.execute(query, params)
+        if cursor.rowcount:
+            logger.info(f"Released {cursor.rowcount} interrupted {stage} claims")
+        return cursor.rowcount
+
+    def requeue(self, stage, status=FAILED, max_attempts=None):
+        """Move rows with the given outcome back to pending, up to an attempt limit"""
+        query = "UPDATE jobs SET status = ? WHERE stage = ? AND status = ?"
+        params = [PENDING, stage, status]
+        if max_attempts is not None:
+            query += " AND attempts < ?"
+            params.append(max_attempts)
+
+        with self.lock:
+            return self.conn.execute(query, params).rowcount
+
+    def claim(self, stage, limit=1, worker_id=None, lease=None):
+        """Atomically claim up to ``limit`` pending rows, returning (ref_id, url) pairs
+
+        With a ``lease`` in seconds the claim is held for ``worker_id`` only
+        until it expires, and expired claims of other workers are taken back
+        into the queue first.
+        """
+        now = time.time()
+        lease_until = now + lease if lease else None
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                expired = self.conn.execute(
+                    "UPDATE jobs SET status = ?, worker_id = NULL, lease_until = NULL "
+                    "WHERE stage = ? AND status = ? AND lease_until < ?",
+                    (PENDING, stage, CLAIMED, now)
+                ).rowcount
+                if expired:
+                    logger.warning(f"Took back {expired} {stage} rows with expired leases")
+
+                rows = self.conn.execute(
+                    "SELECT ref_id, url FROM jobs WHERE stage = ? AND status = ? ORDER BY rowid LIMIT ?",
+                    (stage, PENDING, limit)
+                ).fetchall()
+                self.conn.executemany(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, claimed_at = ?, updated_at = ?, "
+                    "worker_id = ?, lease_until = ? WHERE stage = ? AND url = ?",
+                    ((CLAIMED, now, now, worker_id, lease_until, stage, url) for _, url in rows)
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def iter_claims(self, stage, batch_size=100, worker_id=None, lease=None):
+        """Claim pending rows lazily in batches, yielding (ref_id, url) pairs"""
+        while True:
+            rows = self.claim(stage, batch_size, worker_id, lease)
+            if not rows:
+                return
+            yield from rows
+
+    def renew(self, worker_id, lease):
+        """Extend the leases of every row the worker has claimed, returning how many it holds"""
+        with self.lock:
+            return self.conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE worker_id = ? AND status = ?",
+                (time.time() + lease, worker_id, CLAIMED)
+            ).rowcount
+
+    def complete(self, stage, url, status=DONE, worker_id=None):
+        """Record the outcome of a claimed row
+
+        With a ``worker_id`` the outcome is only recorded while that worker
+        still holds the claim; returns whether the row was updated.
+        """
+        return self._finish(stage, url, status, None, worker_id)
+
+    def fail(self, stage, url, error=None, worker_id=None):
+        """Mark a claimed row as failed, keeping the error message"""
+        return self._finish(stage, url, FAILED, str(error) if error else None, worker_id)
+
+    def _finish(self, stage, url, status, error, worker_id):
+        query = "UPDATE jobs SET status = ?, updated_at = ?, error = ?, lease_until = NULL WHERE stage = ? AND url = ?"
+        params = [status, time.time(), error, stage, url]
+        if worker_id is not None:
+            query += " AND worker_id = ? AND status = ?"
+            params.extend([worker_id, CLAIMED])
+
+        with self.lock:
+            return self.conn.execute(query, params).rowcount > 0
+
+    def counts(self, stage):
+        """Get the number of rows per status for a stage"""
+        with self.lock:
+            return dict(self.conn.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE stage = ? GROUP BY status", (stage,)
+            ).fetchall())
+
+    def export_csv(self, stage, csv_file, header=None):
+        """Write the stage's rows and statuses back out in the CSV layout"""
+        tmp_file = csv_file.with_name(csv_file.name + ".tmp")
+        with self.lock, open(tmp_file, 'w', newline='') as f:
+            writer = csv.writer(f)
+            if header:
+                writer.writerow(header)
+            writer.writerows(self.conn.execute(
+                "SELECT ref_id, url, status FROM jobs WHERE stage = ? ORDER BY rowid", (stage,)
+            ))
+            end = f.tell()
+        tmp_file.replace(csv_file)
+        self._record_offset(stage, csv_file, end)
@@ -2,33 +2,205 @@
 Module for fetching snapshots from the Wayback Machine.
 """
 
+import os
 import csv
+import json
 import requests
-import pandas as pd
 from calendar import monthrange
 from random import randint
 import logging
-import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import urlencode
+
+from rate_limiter import request_with_retry
 
 logger = logging.getLogger(__name__)
 
+CDX_ENDPOINT = "https://web.archive.org/cdx/search/cdx"
+SNAPSHOT_STATE_FILE = "snapshot_state.json"
+TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+WAYBACK_WEB_PREFIX = "https://web.archive.org/web"
+
+# Column types of the snapshots file, and rows read at a time when cleaning it
+SNAPSHOT_DTYPES = {'timestamp': 'int64', 'url': 'object', 'status': 'category'}
+SNAPSHOT_CHUNK_ROWS = 20_000
+
+# Number of timestamp digits the CDX server compares when collapsing captures
+COLLAPSE_DIGITS = {
+    'year': 4,
+    'month': 6,
+    'day': 8,
+    'hour': 10,
+}
+
+# Captures reach the CDX index with a delay, so the most recent period is queried again on the next run
+SETTLE_DELAY = timedelta(days=1)
+
+
+def year_bounds(start_year, end_year):
+    """Get the first and last CDX timestamps of a range of years"""
+    return f"{start_year}0101000000", f"{end_year}1231235959"
+
+
+def state_key(link, collapse):
+    """Get the key of a link's ranges in snapshot_state.json for a collapse setting
+
+    Ranges queried at one density do not cover another, so each setting,
+    or 'available' for the availability API, has ranges of its own.
+    """
+    return f"{link} collapse={collapse}"
+
+
+def _parse_timestamp(timestamp):
+    return datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+
+
+def _format_timestamp(moment):
+    return moment.strftime(TIMESTAMP_FORMAT)
+
+
+class SnapshotState:
+    """Date ranges already queried for each link of a site, kept in snapshot_state.json
+
+    Each link and collapse setting (see ``state_key``) maps to a sorted list
+    of disjoint [from, to] timestamp ranges whose snapshots are in
+    urls_wayback.csv. The end of the last range is the link's high-water
+    mark; holes before it are ranges that failed and are queried again.
+    Ranges are only recorded up to ``SETTLE_DELAY`` ago, as the index may
+    still be catching up on later captures. Ranges are recorded as they are
+    queried, but the state must only be saved once their snapshots are on disk.
+    """
+
+    def __init__(self, path):
+        """Load the state from the given file, starting empty if it does not exist"""
+        self.path = Path(path)
+        self.settled = _format_timestamp(datetime.now() - SETTLE_DELAY)
+        self.links = {}
+        if self.path.exists():
+            with open(self.path, 'r') as f:
+                self.links = json.load(f).get('links', {})
+
+    def high_water_mark(self, link):
+        """Get the last timestamp queried for a link, or None"""
+        ranges = self.links.get(link)
+        return ranges[-1][1] if ranges else None
+
+    def missing(self, link, start, end):
+        """Get the (from, to) ranges between two timestamps that have not been queried for a link"""
+        missing = []
+        cursor = start
+        for covered_from, covered_to in self.links.get(link, []):
+            if covered_to < cursor:
+                continue
+            if covered_from > end:
+                break
+            if covered_from > cursor:
+                missing.append((cursor, _format_timestamp(_parse_timestamp(covered_from) - timedelta(seconds=1))))
+            cursor = _format_timestamp(_parse_timestamp(covered_to) + timedelta(seconds=1))
+        if cursor <= end:
+            missing.append((cursor, end))
+        return missing
+
+    def cover(self, link, start, end):
+        """Record that a link's snapshots between two timestamps have been queried"""
+        end = min(end, self.settled)
+        if end < start:
+            return
+
+        merged = []
+        for covered_from, covered_to in sorted(self.links.get(link, []) + [[start, end]]):
+            # Join ranges that overlap or touch
+            if merged and _parse_timestamp(covered_from) <= _parse_timestamp(merged[-1][1]) + timedelta(seconds=1):
+                merged[-1][1] = max(merged[-1][1], covered_to)
+            else:
+                merged.append([covered_from, covered_to])
+        self.links[link] = merged
+
+    def save(self):
+        """Write the state to its file, replacing it atomically"""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({'links': self.links}, f, indent=1)
+        tmp_path.replace(self.path)
+
+
+class RequestsTransport:
+    """Default CDX transport that queries the endpoint over HTTP"""
+
+    def __init__(self, endpoint=CDX_ENDPOINT, timeout=60, cache=None, limiter=None, client=None):
+        """Initialize with the CDX endpoint to query, an optional response cache, rate limiter and HTTP client"""
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.cache = cache
+        self.limiter = limiter
+        self.get = client.get if client else requests.get
+
+    def get_json(self, params):
+        """Run a CDX query and return the decoded JSON rows"""
+        # Only ranges that ended before this year are final and safe to replay
+        cacheable = self.cache is not None and str(params.get('to', ''))[:4] < str(datetime.now().year)
+        request_url = f"{self.endpoint}?{urlencode(sorted(params.items()))}"
+        
+        body = self.cache.get(request_url) if cacheable else None
+        if body is None:
+            response = request_with_retry(self.get, self.endpoint, limiter=self.limiter,
+                                          params=params, timeout=self.timeout)
+            response.raise_for_status()
+            body = response.content
+            if cacheable:
+                self.cache.put(request_url, body)
+        
+        if not body.strip():
+            return []
+        return json.loads(body)
+
 
 class WaybackMachineScraper:
     """Handles fetching URLs from the Wayback Machine archive"""
     
-    def __init__(self, config):
-        """Initialize with the provided configuration"""
+    def __init__(self, config, mode='cdx', collapse='day', page_size=5000, transport=None, incremental=False):
+        """Initialize with the provided configuration
+
+        ``mode`` selects snapshot discovery: 'cdx' pulls whole date ranges in
+        paged bulk queries, 'available' polls the availability API once a day.
+        ``collapse`` ('year', 'month', 'day' or 'hour') is the sampling density
+        for CDX mode and can be overridden per URL entry in sites.json.
+        ``transport`` is any object with a ``get_json(params)`` method, so a
+        local fixture server or canned responses can stand in for archive.org.
+        With ``incremental`` set, only dates past each link's high-water mark
+        in snapshot_state.json, or left unqueried by failed runs, are queried,
+        and new snapshots are appended to urls_wayback.csv.
+        """
+        if mode not in ('cdx', 'available'):
+            raise ValueError(f"Unknown snapshot discovery mode: {mode}")
+        if collapse not in COLLAPSE_DIGITS:
+            raise ValueError(f"Unknown collapse granularity: {collapse}")
+        
         self.config = config
+        self.mode = mode
+        self.collapse = collapse
+        self.page_size = page_size
+        self.incremental = incremental
+        self.limiter = config.get_rate_limiter()
+        self.http = config.get_http_client()
+        self.transport = transport or RequestsTransport(cache=config.open_response_cache(), limiter=self.limiter,
+                                                        client=self.http)
     
     def get_snapshots(self, site_name):
         """Fetch Wayback Machine snapshots for the specified site"""
         site_config = self.config.sites[site_name]
         output_file = self.config.get_site_data_path(site_name, "urls_wayback.csv")
+        state = self.open_state(site_name) if self.incremental else None
         
-        # Ensure the file exists and has a header
-        with open(output_file, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['timestamp', 'url', 'status'])
+        # Ensure the file exists and has a header; incremental runs add to the existing file
+        known_timestamps = set()
+        if state is None or not output_file.exists():
+            with open(output_file, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['timestamp', 'url', 'status'])
+        else:
+            known_timestamps = self._read_timestamps(output_file)
         
         # Process each URL configuration for the site
         for url_idx, url_config in site_config['url'].items():
@@ -37,93 +209,264 @@ class WaybackMachineScraper:
             end_year = url_config['end_year']
             
             logger.info(f"Fetching Wayback Machine snapshots for {site_name} ({url_link}) from {start_year} to {end_year}")
-            self._get_archive_urls(url_link, start_year, end_year, output_file)
+            if self.mode == 'cdx':
+                collapse = url_config.get('collapse', self.collapse)
+                snapshots = self.iter_cdx_site(url_link, start_year, end_year, collapse, state=state)
+            else:
+                snapshots = self._iter_archive_site(url_link, start_year, end_year, state=state)
+            self._append_snapshots(snapshots, output_file, known_timestamps, url_link, state=state)
         
-        # Remove duplicates
-        self._clean_snapshots_file(output_file)
+        # Remove duplicates; incremental runs only ever append new timestamps
+        if state is None:
+            self._clean_snapshots_file(output_file)
         
         logger.info(f"Completed fetching snapshots for {site_name}")
     
-    def _get_archive_urls(self, site, start_year, end_year, file_path):
-        """Get URLs from Wayback Machine for a specific date range"""
-        import re  # For regex pattern matching
+    def open_state(self, site_name):
+        """Load the record of date ranges already queried for the site"""
+        return SnapshotState(self.config.get_site_data_path(site_name, SNAPSHOT_STATE_FILE))
+    
+    @staticmethod
+    def _read_timestamps(file_path):
+        """Get the snapshot timestamps already in the snapshots file"""
+        with open(file_path, 'r', newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            return {row[0] for row in reader if row}
+    
+    def _iter_cdx_snapshots(self, site, start, end, collapse):
+        """Yield (timestamp, original_url) pairs between two timestamps from the CDX index, in timestamp order"""
+        params = {
+            'url': site,
+            'from': start,
+            'to': end,
+            'output': 'json',
+            'fl': 'timestamp,original',
+            'filter': 'statuscode:200',
+            'collapse': f"timestamp:{COLLAPSE_DIGITS[collapse]}",
+            'limit': self.page_size,
+            'showResumeKey': 'true',
+        }
         
+        while True:
+            rows = self.transport.get_json(params)
+            
+            # First row is the field header; a resume key follows an empty row
+            resume_key = None
+            if len(rows) >= 2 and rows[-2] == []:
+                resume_key = rows[-1][0]
+                rows = rows[:-2]
+            
+            for row in rows[1:]:
+                yield row[0], row[1]
+            
+            if not resume_key:
+                break
+            params['resumeKey'] = resume_key
+    
+    def iter_snapshots(self, site_name):
+        """Yield (timestamp, snapshot_url) pairs for the site as the CDX index pages arrive
+
+        In incremental mode, the caller must have stored each pair before
+        asking for the next one, as the ranges they came from are then saved
+        as queried.
+        """
+        if self.mode != 'cdx':
+            raise ValueError("Streaming snapshot discovery requires mode='cdx'")
+        
+        state = self.open_state(site_name) if self.incremental else None
+        for url_idx, url_config in self.config.sites[site_name]['url'].items():
+            collapse = url_config.get('collapse', self.collapse)
+            yield from self.iter_cdx_site(url_config['link'], url_config['start_year'],
+                                          url_config['end_year'], collapse, state=state)
+            if state:
+                state.save()
+    
+    def iter_cdx_site(self, site, start_year, end_year, collapse, raise_errors=False, state=None):
+        """Yield (timestamp, snapshot_url) pairs for a site link and its known redirects
+
+        Query errors are logged and skipped unless ``raise_errors`` is set.
+        With a ``state``, only ranges it has not recorded for this collapse
+        setting are queried, and the ranges queried successfully are recorded
+        in it; saving it is left to the caller.
+        """
+        start, end = year_bounds(start_year, end_year)
+        
+        for current_site in self._sites_to_check(site):
+            key = state_key(current_site, collapse)
+            ranges = state.missing(key, start, end) if state else [(start, end)]
+            if not ranges:
+                logger.info(f"Snapshots for {current_site} are up to date through {state.high_water_mark(key)}")
+                continue
+            
+            logger.info(f"Querying CDX index for {current_site} (collapse by {collapse})")
+            found = 0
+            
+            for range_start, range_end in ranges:
+                last_timestamp = None
+                try:
+                    for snapshot_timestamp, original_url in self._iter_cdx_snapshots(
+                            current_site, range_start, range_end, collapse):
+                        found += 1
+                        last_timestamp = snapshot_timestamp
+                        yield snapshot_timestamp, f"{WAYBACK_WEB_PREFIX}/{snapshot_timestamp}/{original_url}"
+                    
+                    if state:
+                        state.cover(key, range_start, range_end)
+                
+                except Exception as e:
+                    logger.error(f"Error querying CDX index for {current_site}: {e}")
+                    # Captures arrive in timestamp order, so the range is complete up to the last one
+                    if state and last_timestamp:
+                        state.cover(key, range_start, last_timestamp)
+                    if raise_errors:
+                        raise
+            
+            logger.info(f"Found {found} snapshots for {current_site} from {start_year} to {end_year}")
+    
+    @staticmethod
+    def _sites_to_check(site):
+        """Get a site link and the known redirects whose snapshots belong to it"""
+        sites_to_check = [site]
+        # Common redirects for Fox News we know about
+        if 'foxnews.com/us/' in site:
+            sites_to_check.append('http://www.foxnews.com/us/index.html')
+        return sites_to_check
+    
+    def _append_snapshots(self, snapshots, file_path, known_timestamps, site, state=None):
+        """Append (timestamp, snapshot_url) pairs with new timestamps to the snapshots file
+
+        A ``state`` is saved each time the file is flushed, so the ranges it
+        records as queried never run ahead of the rows on disk.
+        """
         with open(file_path, 'a', newline='') as file:
             writer = csv.writer(file)
             
-            # Start with the initial site
-            sites_to_check = {site}
-            # Track discovered redirects to avoid duplicating work
-            discovered_redirects = {}
+            saved = 0
+            for snapshot_timestamp, snapshot_url in snapshots:
+                if snapshot_timestamp in known_timestamps:
+                    continue
+                known_timestamps.add(snapshot_timestamp)
+                writer.writerow([snapshot_timestamp, snapshot_url, 'no'])
+                saved += 1
+                
+                # Stream results to disk as pages arrive
+                if saved % self.page_size == 0:
+                    self._sync_snapshots(file, state)
+                    logger.info(f"Saved {saved} snapshots for {site} so far")
             
-            # Common redirects for Fox News we know about
-            if 'foxnews.com/us/' in site:
-                sites_to_check.add('http://www.foxnews.com/us/index.html')
+            self._sync_snapshots(file, state)
+        
+        logger.info(f"Saved {saved} new snapshots for {site}")
+    
+    @staticmethod
+    def _sync_snapshots(file, state):
+        """Force the snapshots file to disk, then save the state of the ranges its rows came from"""
+        file.flush()
+        if state:
+            os.fsync(file.fileno())
+            state.save()
+    
+    def _iter_archive_site(self, site, start_year, end_year, state=None):
+        """Yield (timestamp, snapshot_url) pairs for a site link by polling the availability API once a day
+
+        With a ``state``, only days it has not recorded are polled, and each
+        day answered by the API is recorded in it; saving it is left to the caller.
+        """
+        import re  # For regex pattern matching
+        
+        start, end = year_bounds(start_year, end_year)
+        
+        for current_site in self._sites_to_check(site):
+            key = state_key(current_site, 'available')
+            ranges = state.missing(key, start, end) if state else [(start, end)]
+            logger.info(f"Checking snapshots for {current_site}")
             
-            for current_site in sites_to_check:
-                logger.info(f"Checking snapshots for {current_site}")
-                
-                for year in range(start_year, end_year + 1):
-                    for month in range(1, 13):
-                        for day in range(1, monthrange(year, month)[1] + 1):       
-                            try:
-                                # Format: YYYYMMDDHHMMSS
-                                timestamp = f"{year}{month:02d}{day:02d}{randint(0,9)}{randint(0,9)}{randint(0,9)}"
-                                request_url = f"https://archive.org/wayback/available?url={current_site}&timestamp={timestamp}"
-                                
-                                response = requests.get(request_url, timeout=30)
-                                if response.status_code != 200:
-                                    logger.warning(f"Failed to fetch archive for {current_site} on {year}-{month}-{day}: Status {response.status_code}")
-                                    continue
+            for year in range(start_year, end_year + 1):
+                for month in range(1, 13):
+                    for day in range(1, monthrange(year, month)[1] + 1):
+                        date_key = f"{year}{month:02d}{day:02d}"
+                        if not any(range_start[:8] <= date_key <= range_end[:8] for range_start, range_end in ranges):
+                            continue
+                        
+                        try:
+                            # Format: YYYYMMDDHHMMSS
+                            timestamp = f"{date_key}{randint(0,9)}{randint(0,9)}{randint(0,9)}"
+                            request_url = f"https://archive.org/wayback/available?url={current_site}&timestamp={timestamp}"
+                            
+                            response = request_with_retry(self.http.get, request_url, limiter=self.limiter,
+                                                          timeout=30)
+                            if response.status_code != 200:
+                                logger.warning(f"Failed to fetch archive for {current_site} on {year}-{month}-{day}: Status {response.status_code}")
+                                continue
+                            
+                            data = response.json()
+                            if 'archived_snapshots' in data and 'closest' in data['archived_snapshots']:
+                                snapshot = data['archived_snapshots']['closest']
+                                snapshot_timestamp = snapshot['timestamp']
+                                snapshot_url = snapshot['url']
                                 
-                                data = response.json()
-                                if 'archived_snapshots' in data and 'closest' in data['archived_snapshots']:
-                                    snapshot = data['archived_snapshots']['closest']
-                                    snapshot_timestamp = snapshot['timestamp']
-                                    snapshot_url = snapshot['url']
-                                    
-                                    # Verify this snapshot is from the requested year
-                                    if not snapshot_timestamp.startswith(str(year)):
-                                        logger.warning(f"Snapshot from wrong year ({snapshot_timestamp[:4]} vs {year}) for {current_site} on {year}-{month}-{day}")
-                                        continue
-                                        
+                                # Verify this snapshot is from the requested year
+                                if not snapshot_timestamp.startswith(str(year)):
+                                    logger.warning(f"Snapshot from wrong year ({snapshot_timestamp[:4]} vs {year}) for {current_site} on {year}-{month}-{day}")
+                                else:
                                     # Extract the original URL from the Wayback Machine URL format
                                     match = re.search(r'web/\d+/(.+)', snapshot_url)
                                     if match:
                                         actual_url = match.group(1)
                                         if actual_url != current_site:
-                                            logger.info(f"Snapshot URL points to {actual_url}, which differs from requested {current_site}")
+                                            logger.debug(f"Snapshot URL points to {actual_url}, which differs from requested {current_site}")
                                             # We could add this to sites_to_check for future iterations if needed
-                                    try:
-                                        # Save the snapshot info
-                                        logger.info(f"Found snapshot for {current_site} on {year}-{month}-{day}: {snapshot_url}")
-                                        writer.writerow([snapshot_timestamp, snapshot_url, 'no'])
-                                        logger.info(f"Saved snapshot for {snapshot_timestamp} with {snapshot_url}")
-                                        
-                                    except Exception as e:
-                                        logger.error(f"Error writing snapshot to file: {e}")
-                                        
-                                else:
-                                    logger.warning(f"No snapshot found for {current_site} on {year}-{month}-{day}")
+                                    
+                                    logger.debug(f"Found snapshot for {current_site} on {year}-{month}-{day}: {snapshot_url}")
+                                    yield snapshot_timestamp, snapshot_url
                             
-                            except Exception as e:
-                                logger.error(f"Error fetching archive for {current_site} on {year}-{month}-{day}: {e}")
+                            else:
+                                logger.warning(f"No snapshot found for {current_site} on {year}-{month}-{day}")
                             
-                            # Add small delay to avoid overwhelming the API
-                            time.sleep(0.2)
+                            # The API answered for this day, so it is not polled again
+                            if state:
+                                state.cover(key, f"{date_key}000000", f"{date_key}235959")
+                        
+                        except Exception as e:
+                            logger.error(f"Error fetching archive for {current_site} on {year}-{month}-{day}: {e}")
     
-    def _clean_snapshots_file(self, file_path):
-        """Remove duplicate entries from the snapshots file"""
+    def _clean_snapshots_file(self, file_path, chunk_size=SNAPSHOT_CHUNK_ROWS):
+        """Remove duplicate entries from the snapshots file
+
+        The file is streamed in typed chunks of ``chunk_size`` rows, keeping
+        only a sorted array of the timestamps seen so far, and is replaced
+        only if duplicates were found.
+        """
+        # Only needed here, so not imported with the module
+        import numpy as np
+        import pandas as pd
+        
+        tmp_path = file_path.with_name(file_path.name + ".tmp")
         try:
-            df = pd.read_csv(file_path)
-            original_count = len(df)
+            seen = np.zeros(0, dtype=np.int64)
+            original_count = kept_count = 0
             
-            # Drop duplicates based on timestamp
-            df.drop_duplicates(subset=['timestamp'], inplace=True)
+            for index, chunk in enumerate(pd.read_csv(file_path, dtype=SNAPSHOT_DTYPES, chunksize=chunk_size)):
+                # Keep the first row of each timestamp, within the chunk and across earlier chunks
+                timestamps = chunk['timestamp'].to_numpy()
+                known = np.zeros(len(timestamps), dtype=bool)
+                if len(seen):
+                    known = seen[np.minimum(np.searchsorted(seen, timestamps), len(seen) - 1)] == timestamps
+                keep = ~chunk['timestamp'].duplicated().to_numpy() & ~known
+                new = np.sort(timestamps[keep])
+                seen = np.insert(seen, np.searchsorted(seen, new), new)
+                
+                chunk[keep].to_csv(tmp_path, mode='w' if index == 0 else 'a', header=index == 0, index=False)
+                original_count += len(chunk)
+                kept_count += int(keep.sum())
             
-            # Write the cleaned DataFrame back to CSV
-            df.to_csv(file_path, index=False)
+            if kept_count < original_count:
+                tmp_path.replace(file_path)
+            else:
+                tmp_path.unlink(missing_ok=True)
             
-            logger.info(f"Cleaned snapshots file: removed {original_count - len(df)} duplicates")
+            logger.info(f"Cleaned snapshots file: removed {original_count - kept_count} duplicates")
         except Exception as e:
+            tmp_path.unlink(missing_ok=True)
             logger.error(f"Error cleaning snapshots file {file_path}: {e}")
\ No newline at end of file
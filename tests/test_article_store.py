@@ -0,0 +1,26 @@
+from article_store import ArticleStore
+
+
+def test_torn_index_line_is_dropped_before_recovery(tmp_path):
+    store = ArticleStore(tmp_path)
+    store.put("http://a", {"title": "a"})
+    store.put("http://c", {"title": "c"})
+    store.close()
+
+    # Simulate a crash part-way through writing the last index entry
+    index_path = next(tmp_path.glob("*.idx"))
+    data = index_path.read_bytes()
+    index_path.write_bytes(data[:data.rindex(b"http://c") + len("http:")])
+
+    store = ArticleStore(tmp_path)
+    assert store.get("http://a") == {"title": "a"}
+    assert store.get("http://c") == {"title": "c"}
+    assert sorted(store.urls()) == ["http://a", "http://c"]
+    store.put("http://d", {"title": "d"})
+    store.close()
+
+    store = ArticleStore(tmp_path)
+    assert sorted(store.urls()) == ["http://a", "http://c", "http://d"]
+    assert store.get("http://c") == {"title": "c"}
+    store.close()
+    assert all(len(line.split("\t")) == 3 for line in index_path.read_text().splitlines())
@@ -0,0 +1,17 @@
+from rate_limiter import AdaptiveRateLimiter, CircuitBreaker
+
+
+def test_throttled_responses_open_the_circuit():
+    limiter = AdaptiveRateLimiter(10, failure_threshold=3)
+    for _ in range(3):
+        limiter.observe(["example.com"], 429, 0.1)
+    assert limiter.circuits()["example.com"] == CircuitBreaker.OPEN
+
+
+def test_healthy_response_resets_throttle_failures():
+    limiter = AdaptiveRateLimiter(10, failure_threshold=3)
+    limiter.observe(["example.com"], 429, 0.1)
+    limiter.observe(["example.com"], 429, 0.1)
+    limiter.observe(["example.com"], 200, 0.1)
+    limiter.observe(["example.com"], 429, 0.1)
+    assert limiter.circuits()["example.com"] == CircuitBreaker.CLOSED